@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+"""
+Benchmark of materialising chunkers against map(list, chunks(...)).
+
+Usage:
+    PYTHONPATH=. python benchmarks/chunks.py [items_count]
+"""
+
+import asyncio
+import sys
+from timeit import default_timer
+
+from snuff_utils.iterators import async_chunks, chunks, list_chunks, tuple_chunks, weighted_chunks
+
+
+def measure(func, *args, **kwargs):
+    start = default_timer()
+    func(*args, **kwargs)
+    return default_timer() - start
+
+
+def consume(chunks_iterator):
+    for _ in chunks_iterator:
+        pass
+
+
+async def async_items(items):
+    for item in items:
+        yield item
+
+
+def consume_async(items, n):
+    async def run():
+        async for _ in async_chunks(async_items(items), n):
+            pass
+    asyncio.run(run())
+
+
+def consume_async_by_chunks(items, n):
+    """Previous way: sync chunks of items collected from an async iterable"""
+    async def run():
+        collected = [item async for item in async_items(items)]
+        consume(map(list, chunks(collected, n)))
+    asyncio.run(run())
+
+
+def main(items_count=1000000):
+    items = list(range(items_count))
+    print(f'{items_count} items')
+    for n in (10, 1000, 100000):
+        for source_name, source in (('list', lambda: items), ('iterator', lambda: iter(items))):
+            previous = measure(consume, map(list, chunks(source(), n)))
+            as_lists = measure(consume, list_chunks(source(), n))
+            as_tuples = measure(consume, tuple_chunks(source(), n))
+            print(f'n={n:<7} {source_name:8} map(list, chunks): {previous:.3f}s, list_chunks: {as_lists:.3f}s '
+                  f'({previous / as_lists:.1f}x), tuple_chunks: {as_tuples:.3f}s ({previous / as_tuples:.1f}x)')
+
+    documents = [str(i) * (i % 20 + 1) for i in range(items_count)]
+    weighted = measure(consume, weighted_chunks(documents, 16 * 1024 * 1024, max_items=100000))
+    print(f'weighted_chunks by 16MB: {weighted:.3f}s')
+
+    previous = measure(consume_async_by_chunks, items, 1000)
+    current = measure(consume_async, items, 1000)
+    print(f'async: collect and chunks: {previous:.3f}s, async_chunks: {current:.3f}s')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+"""
+Benchmark of compiled DictProjector against dict_copy called for every row.
+
+Usage:
+    PYTHONPATH=. python benchmarks/dict_copy.py [rows_count] [fields_count]
+"""
+
+import sys
+from timeit import default_timer
+
+from snuff_utils.dict_functions import compile_dict_copy, dict_copy
+
+
+def measure(func, *args, **kwargs):
+    start = default_timer()
+    func(*args, **kwargs)
+    return default_timer() - start
+
+
+def copy_rows(rows, fields=None, **kwargs):
+    return [dict_copy(row, fields, **kwargs) for row in rows]
+
+
+def project_rows(rows, fields=None, **kwargs):
+    return list(compile_dict_copy(fields, **kwargs).map(rows))
+
+
+def main(rows_count=200000, fields_count=30):
+    rows = [{f'field_{j}': i * j for j in range(fields_count)} for i in range(rows_count)]
+    print(f'{rows_count} rows of {fields_count} fields')
+    cases = (
+        ('3 fields', ('field_1,field_5,field_7',), {}),
+        ('3 fields and rename', ('field_1,field_5',), {'renamed': 'field_7'}),
+        ('rename only', (), {'renamed': 'field_7'}),
+        ("'*' and rename", ('*',), {'renamed': 'field_7'}),
+        ('plain copy', (), {}),
+    )
+    for name, args, kwargs in cases:
+        previous = measure(copy_rows, rows, *args, **kwargs)
+        compiled = measure(project_rows, rows, *args, **kwargs)
+        print(f'{name:20} dict_copy: {previous:.3f}s, compile_dict_copy: {compiled:.3f}s ({previous / compiled:.1f}x)')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
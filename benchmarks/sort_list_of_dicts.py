@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+"""
+Benchmark of sort_list_of_dicts against the previous per-row key implementation.
+
+Usage:
+    PYTHONPATH=. python benchmarks/sort_list_of_dicts.py [rows_count]
+"""
+
+import sys
+from random import Random
+from timeit import default_timer
+
+from snuff_utils.list_of_dicts import sort_list_of_dicts
+
+
+def previous_sort_list_of_dicts(lst, keys, reverse=False, default=None, **convert):
+    """sort_list_of_dicts before precomputed keys: key spec is resolved for every row"""
+    keys = keys.split(',') if isinstance(keys, str) else keys
+    keys_list = []
+    for key in keys:
+        field, direction = (key[1:], -1) if isinstance(key, str) and key.startswith('-') else (key, 1)
+        keys_list.append(dict(direction=direction, field=field))
+
+    def key(x):
+        result = []
+        for k in keys_list:
+            field = k['field']
+            k_default = default.get(field) if isinstance(default, dict) else default
+            value = x.get(field, k_default)
+            if field in convert:
+                value = convert[field](value)
+            result.append(k['direction'] * value)
+        return result
+
+    return sorted(lst, key=key, reverse=reverse)
+
+
+def measure(func, *args, **kwargs):
+    start = default_timer()
+    func(*args, **kwargs)
+    return default_timer() - start
+
+
+def main(rows_count=1000000):
+    random = Random(0)
+    rows = [
+        {'amount': random.randint(0, 1000), 'client': random.randint(0, 5000), 'date': random.random()}
+        for _ in range(rows_count)
+    ]
+    print(f'{rows_count} rows')
+    for keys in ('amount', '-amount', 'amount,client', '-amount,client,-date'):
+        previous = measure(previous_sort_list_of_dicts, rows, keys, default=0)
+        current = measure(sort_list_of_dicts, rows, keys, default=0)
+        print(f'{keys:24} previous: {previous:.3f}s, current: {current:.3f}s, speedup: {previous / current:.1f}x')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
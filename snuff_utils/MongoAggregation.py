@@ -9,6 +9,7 @@ import logging
 from copy import copy
 from itertools import chain, combinations, product
 
+from .MongoLocalAggregation import MongoLocalAggregation
 from .mongo_aggregation_patterns import dollar_prefix, pop_dollar_prefix
 
 logger = logging.getLogger(__name__)
@@ -36,6 +37,17 @@ class MongoAggregation(list):
             result = self.collection.aggregate(self.pipeline, allowDiskUse=self.allowDiskUse, collation=collation)
         return list(result) if as_list else result
 
+    def aggregate_local(self, documents, collections=None, as_list=False):
+        """
+        Runs pipeline over an in-memory iterable of dicts instead of a collection.
+        Duration of stages is available in self.local_aggregation.stages_timing after result is consumed.
+        :param documents: iterable of dicts
+        :param collections: dict of collection name -> list of dicts, for $lookup stages
+        """
+        self.local_aggregation = MongoLocalAggregation(self.pipeline, collections)
+        result = self.local_aggregation.aggregate(documents)
+        return list(result) if as_list else result
+
     def append(self, object=None, *args):
         if not object: object = []
         if isinstance(object, list):
@@ -0,0 +1,817 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+"""
+Local execution of MongoDB aggregation pipelines (as built by MongoAggregation) over in-memory iterables of dicts.
+"""
+
+import logging
+import re
+from datetime import datetime
+from functools import lru_cache, partial
+from itertools import islice
+from numbers import Number
+from time import perf_counter
+
+try:
+    from .list_of_dicts import join_list_of_dicts
+except:
+    from snuff_utils.list_of_dicts import join_list_of_dicts
+
+logger = logging.getLogger(__name__)
+
+# Value of a missing field path
+_MISSING = object()
+# End of documents of a stage in _timed
+_END = object()
+
+
+class MongoLocalAggregation(object):
+    """
+    Executes aggregation pipeline against an iterable of dicts.
+
+    Supported stages: $match, $project, $addFields, $group, $sort, $skip, $limit, $unwind, $lookup, $count.
+    $match, $project, $addFields, $skip, $limit, $unwind and $lookup stream documents,
+    $group and $sort collect all input documents.
+    Duration of every stage (without previous stages) is collected in stages_timing while result is consumed.
+
+    >>> orders = [
+    ...     {'_id': 1, 'client': 'a', 'amount': 5, 'items': ['x', 'y']},
+    ...     {'_id': 2, 'client': 'b', 'amount': 7, 'items': ['x']},
+    ...     {'_id': 3, 'client': 'a', 'amount': 1, 'items': []},
+    ... ]
+    >>> aggregation = MongoLocalAggregation([
+    ...     {'$match': {'amount': {'$gte': 2}}},
+    ...     {'$unwind': '$items'},
+    ...     {'$group': {'_id': '$items', 'total': {'$sum': '$amount'}, 'clients': {'$addToSet': '$client'}}},
+    ...     {'$sort': {'total': -1}},
+    ... ])
+    >>> list(aggregation.aggregate(orders))
+    [{'_id': 'x', 'total': 12, 'clients': ['a', 'b']}, {'_id': 'y', 'total': 5, 'clients': ['a']}]
+    >>> [stage['stage'] for stage in aggregation.stages_timing]
+    ['$match', '$unwind', '$group', '$sort']
+    >>> clients = [{'_id': 'a', 'name': 'Ann'}]
+    >>> list(MongoLocalAggregation([
+    ...     {'$lookup': {'from': 'client', 'localField': 'client', 'foreignField': '_id', 'as': 'client'}},
+    ...     {'$unwind': {'path': '$client', 'preserveNullAndEmptyArrays': True}},
+    ...     {'$project': {'_id': 0, 'name': '$client.name', 'amount': 1}},
+    ...     {'$limit': 2},
+    ... ], collections={'client': clients}).aggregate(orders))
+    [{'amount': 5, 'name': 'Ann'}, {'amount': 7}]
+    >>> list(MongoLocalAggregation([
+    ...     {'$lookup': {'from': 'client', 'localField': 'ids', 'foreignField': '_id', 'as': 'x.cl'}},
+    ... ], collections={'client': clients}).aggregate([{'ids': ['a', 'b'], 'x': {'y': 1}}]))
+    [{'ids': ['a', 'b'], 'x': {'y': 1, 'cl': [{'_id': 'a', 'name': 'Ann'}]}}]
+    >>> list(MongoLocalAggregation([{'$sort': {'limit': 1, 'reverse': -1}}]).aggregate(
+    ...     [{'limit': 2, 'reverse': 1}, {'limit': 1, 'reverse': 1}, {'limit': 1, 'reverse': 2}, {'reverse': 3}]
+    ... ))
+    [{'reverse': 3}, {'limit': 1, 'reverse': 2}, {'limit': 1, 'reverse': 1}, {'limit': 2, 'reverse': 1}]
+    """
+
+    def __init__(self, pipeline, collections=None):
+        """
+        :param pipeline: list of stages
+        :param collections: dict of collection name -> list of dicts, for $lookup stages
+        """
+        self.pipeline = pipeline
+        self.collections = collections or {}
+        self.stages_timing = []
+
+    def aggregate(self, documents):
+        """
+        Runs pipeline over documents
+        :param documents: iterable of dicts
+        :return: iterator of result documents
+        """
+        self.stages_timing = []
+        upstream = None
+        result = iter(documents)
+        for stage in self.pipeline:
+            name, statement = next(iter(stage.items()))
+            handler = _STAGES.get(name)
+            if handler is None:
+                raise NotImplementedError(f"Stage {name} is not supported by local aggregation")
+            timing = {'stage': name, 'time': 0.0, 'documents': 0, 'inclusive': 0.0}
+            self.stages_timing.append(timing)
+            result = self._timed(partial(handler, self, statement, result), timing, upstream)
+            upstream = timing
+        return result
+
+    @staticmethod
+    def _timed(stage, timing, upstream=None):
+        """
+        Runs the stage lazily and measures time spent by the stage itself:
+        inclusive time minus the time of upstream stages
+        """
+        iterator = None
+        while True:
+            upstream_before = upstream['inclusive'] if upstream else 0.0
+            start = perf_counter()
+            try:
+                if iterator is None:
+                    iterator = iter(stage())
+                document = next(iterator)
+            except StopIteration:
+                document = _END
+            elapsed = perf_counter() - start
+            timing['inclusive'] += elapsed
+            upstream_elapsed = (upstream['inclusive'] if upstream else 0.0) - upstream_before
+            timing['time'] += elapsed - upstream_elapsed
+            if document is _END:
+                return
+            timing['documents'] += 1
+            yield document
+
+    def print_summary(self, prefix=''):
+        """Logs duration of stages in milliseconds, as Timer.print_summary does"""
+        logger.info('PROFILING: {}{}'.format(prefix, ', '.join(
+            '{} {}: {}'.format(i, timing['stage'], int(timing['time'] * 1000))
+            for i, timing in enumerate(self.stages_timing)
+        )))
+
+    def _match(self, query, documents):
+        return (document for document in documents if match_document(document, query))
+
+    def _project(self, specification, documents):
+        return map(compile_projection(specification), documents)
+
+    def _add_fields(self, specification, documents):
+        for document in documents:
+            document = dict(document)
+            for path, expression in specification.items():
+                value = evaluate(expression, document)
+                document = _set_path(document, path, value) if value is not _MISSING else document
+            yield document
+
+    def _group(self, specification, documents):
+        id_expression = specification.get('_id')
+        accumulators = [
+            (field, *next(iter(expression.items())))
+            for field, expression in specification.items() if field != '_id'
+        ]
+        for field, operator, expression in accumulators:
+            if operator not in _ACCUMULATORS:
+                raise NotImplementedError(f"Accumulator {operator} is not supported by local aggregation")
+
+        groups = {}
+        for document in documents:
+            group_id = evaluate(id_expression, document)
+            group_id = None if group_id is _MISSING else group_id
+            key = _freeze(group_id)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [group_id, [_ACCUMULATORS[operator][0]() for _, operator, _ in accumulators]]
+            states = group[1]
+            for i, (field, operator, expression) in enumerate(accumulators):
+                states[i] = _ACCUMULATORS[operator][1](states[i], evaluate(expression, document))
+
+        for group_id, states in groups.values():
+            result = {'_id': group_id}
+            for (field, operator, expression), state in zip(accumulators, states):
+                result[field] = _ACCUMULATORS[operator][2](state)
+            yield result
+
+    def _sort(self, specification, documents):
+        documents = list(documents)
+        # Stable passes from the last field to the first one
+        for field, direction in reversed(list(specification.items())):
+            documents.sort(key=partial(_path_sort_key, field), reverse=direction < 0)
+        return iter(documents)
+
+    def _skip(self, count, documents):
+        return islice(documents, count, None)
+
+    def _limit(self, count, documents):
+        return islice(documents, count)
+
+    def _unwind(self, specification, documents):
+        if isinstance(specification, str):
+            specification = {'path': specification}
+        path = specification['path'][1:]
+        preserve = specification.get('preserveNullAndEmptyArrays', False)
+        index_field = specification.get('includeArrayIndex')
+        for document in documents:
+            value = get_path(document, path)
+            if isinstance(value, list) and value:
+                for i, item in enumerate(value):
+                    unwound = _set_path(document, path, item)
+                    yield _set_path(unwound, index_field, i) if index_field else unwound
+            elif not isinstance(value, list) and value is not _MISSING and value is not None:
+                yield _set_path(document, index_field, None) if index_field else document
+            elif preserve:
+                if isinstance(value, list):
+                    document = _unset_path(document, path)
+                yield _set_path(document, index_field, None) if index_field else document
+
+    def _lookup(self, specification, documents):
+        if 'pipeline' in specification:
+            raise NotImplementedError("$lookup with pipeline is not supported by local aggregation")
+        collection = self.collections[specification['from']]
+        as_field = specification['as']
+        # Matches of a nested as field are joined to a temporary key and then set by the path
+        nested = '.' in as_field
+        joined = join_list_of_dicts(
+            documents, collection, specification['localField'], specification['foreignField'],
+            _LOOKUP_MATCHES if nested else as_field, how='left', unwind=False
+        )
+        if not nested:
+            return joined
+        return (_set_path(document, as_field, document.pop(_LOOKUP_MATCHES)) for document in joined)
+
+    def _count(self, field, documents):
+        count = sum(1 for _ in documents)
+        if count:
+            yield {field: count}
+
+
+_LOOKUP_MATCHES = object()
+
+_STAGES = {
+    '$match': MongoLocalAggregation._match,
+    '$project': MongoLocalAggregation._project,
+    '$addFields': MongoLocalAggregation._add_fields,
+    '$set': MongoLocalAggregation._add_fields,
+    '$group': MongoLocalAggregation._group,
+    '$sort': MongoLocalAggregation._sort,
+    '$skip': MongoLocalAggregation._skip,
+    '$limit': MongoLocalAggregation._limit,
+    '$unwind': MongoLocalAggregation._unwind,
+    '$lookup': MongoLocalAggregation._lookup,
+    '$count': MongoLocalAggregation._count,
+}
+
+
+def get_path(document, path):
+    """
+    Value of a dotted path, _MISSING if there is none.
+    Over arrays returns the list of values of their elements (as Mongo field paths do).
+    """
+    value = document
+    for step in _steps(path):
+        if isinstance(value, dict):
+            value = value.get(step, _MISSING)
+        elif isinstance(value, list):
+            values = [get_path(item, step) for item in value if isinstance(item, (dict, list))]
+            value = [item for item in values if item is not _MISSING]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+@lru_cache(maxsize=None)
+def _steps(path):
+    return tuple(path.split('.'))
+
+
+def _set_path(document, path, value):
+    """Shallow copy of the document with the value set by the dotted path"""
+    step, _, rest = path.partition('.')
+    document = dict(document)
+    if rest:
+        nested = document.get(step)
+        document[step] = _set_path(nested if isinstance(nested, dict) else {}, rest, value)
+    else:
+        document[step] = value
+    return document
+
+
+def _path_sort_key(path, document):
+    """Key of the dotted path value in Mongo order, missing value is equal to null"""
+    return sort_key(get_path(document, path))
+
+
+def _unset_path(document, path):
+    """Shallow copy of the document without the dotted path"""
+    step, _, rest = path.partition('.')
+    if step not in document:
+        return document
+    document = dict(document)
+    if rest and isinstance(document[step], dict):
+        document[step] = _unset_path(document[step], rest)
+    elif not rest:
+        del document[step]
+    return document
+
+
+# Query
+
+def match_document(document, query):
+    """
+    Checks if document matches $match query
+
+    >>> match_document({'a': [1, 5], 'b': {'c': 'x'}}, {'a': {'$gt': 3}, 'b.c': {'$in': ['x', 'y']}})
+    True
+    >>> match_document({'a': 1}, {'$or': [{'a': 2}, {'b': None}]})
+    True
+    >>> match_document({'a': 1}, {'a': {'$exists': True, '$ne': 1}})
+    False
+    """
+    for key, condition in query.items():
+        if key == '$and':
+            if not all(match_document(document, sub_query) for sub_query in condition):
+                return False
+        elif key == '$or':
+            if not any(match_document(document, sub_query) for sub_query in condition):
+                return False
+        elif key == '$nor':
+            if any(match_document(document, sub_query) for sub_query in condition):
+                return False
+        elif key == '$expr':
+            if not _truthy(evaluate(condition, document)):
+                return False
+        elif key.startswith('$'):
+            raise NotImplementedError(f"Query operator {key} is not supported by local aggregation")
+        elif not _match_field(get_path(document, key), condition):
+            return False
+    return True
+
+
+def _match_field(value, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition):
+        return all(_match_operator(value, operator, operand, condition) for operator, operand in condition.items())
+    if isinstance(condition, re.Pattern):
+        return any(isinstance(item, str) and condition.search(item) for item in _candidates(value))
+    return _match_operator(value, '$eq', condition, {})
+
+
+def _candidates(value):
+    """Values to compare with a query value: the value itself and elements of arrays"""
+    if value is _MISSING:
+        return [None]
+    if isinstance(value, list):
+        return [value] + value
+    return [value]
+
+
+def _match_operator(value, operator, operand, condition):
+    if operator == '$eq':
+        return any(_equal(item, operand) for item in _candidates(value))
+    if operator == '$ne':
+        return not any(_equal(item, operand) for item in _candidates(value))
+    if operator in _COMPARISONS:
+        compare = _COMPARISONS[operator]
+        return any(_comparable(item, operand) and compare(item, operand) for item in _candidates(value))
+    if operator == '$in':
+        return any(_match_field(value, item) if isinstance(item, re.Pattern) else _match_operator(value, '$eq', item, {})
+                   for item in operand)
+    if operator == '$nin':
+        return not _match_operator(value, '$in', operand, condition)
+    if operator == '$exists':
+        return (value is not _MISSING) == bool(operand)
+    if operator == '$not':
+        return not _match_field(value, operand)
+    if operator == '$size':
+        return isinstance(value, list) and len(value) == operand
+    if operator == '$regex':
+        flags = sum(_REGEX_FLAGS.get(flag, 0) for flag in condition.get('$options', ''))
+        pattern = re.compile(operand, flags) if isinstance(operand, str) else operand
+        return _match_field(value, pattern)
+    if operator == '$options':
+        return True
+    if operator == '$elemMatch':
+        return isinstance(value, list) and any(
+            match_document(item, operand) if isinstance(item, dict) else _match_field(item, operand)
+            for item in value
+        )
+    if operator == '$all':
+        return all(_match_operator(value, '$eq', item, {}) for item in operand)
+    raise NotImplementedError(f"Query operator {operator} is not supported by local aggregation")
+
+
+def _equal(value, other):
+    if value is _MISSING:
+        value = None
+    return _type_bracket(value) == _type_bracket(other) and value == other
+
+
+def _comparable(value, other):
+    return value is not _MISSING and _type_bracket(value) == _type_bracket(other)
+
+
+_COMPARISONS = {
+    '$gt': lambda value, other: value > other,
+    '$gte': lambda value, other: value >= other,
+    '$lt': lambda value, other: value < other,
+    '$lte': lambda value, other: value <= other,
+}
+
+_REGEX_FLAGS = {'i': re.IGNORECASE, 'm': re.MULTILINE, 's': re.DOTALL, 'x': re.VERBOSE}
+
+
+# Expressions
+
+def evaluate(expression, document):
+    """
+    Evaluates aggregation expression against the document. _MISSING for missing fields.
+
+    >>> evaluate({'$cond': [{'$gt': ['$a', 1]}, {'$multiply': ['$a', 2]}, 0]}, {'a': 3})
+    6
+    >>> evaluate({'b': '$a.b', 'c': {'$literal': '$a'}}, {'a': {'b': 1}})
+    {'b': 1, 'c': '$a'}
+    """
+    if isinstance(expression, str):
+        if expression in ('$$ROOT', '$$CURRENT'):
+            return document
+        if expression.startswith('$$'):
+            raise NotImplementedError(f"Variable {expression} is not supported by local aggregation")
+        if expression.startswith('$'):
+            return get_path(document, expression[1:])
+        return expression
+    if isinstance(expression, list):
+        return [_none_if_missing(evaluate(item, document)) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) == 1:
+        operator, operand = next(iter(expression.items()))
+        if operator.startswith('$'):
+            if operator not in _OPERATORS:
+                raise NotImplementedError(f"Operator {operator} is not supported by local aggregation")
+            return _OPERATORS[operator](operand, document)
+    result = {}
+    for field, value in expression.items():
+        value = evaluate(value, document)
+        if value is not _MISSING:
+            result[field] = value
+    return result
+
+
+def _none_if_missing(value):
+    return None if value is _MISSING else value
+
+
+def _arguments(operand, document):
+    operand = operand if isinstance(operand, list) else [operand]
+    return [_none_if_missing(evaluate(item, document)) for item in operand]
+
+
+def _truthy(value):
+    return value not in (None, False, 0, _MISSING)
+
+
+def _arithmetic(function):
+    def operator(operand, document):
+        arguments = _arguments(operand, document)
+        if any(argument is None for argument in arguments):
+            return None
+        return function(*arguments)
+    return operator
+
+
+def _add(*arguments):
+    result = arguments[0]
+    for argument in arguments[1:]:
+        result = result + argument
+    return result
+
+
+def _multiply(*arguments):
+    result = 1
+    for argument in arguments:
+        result *= argument
+    return result
+
+
+def _cond(operand, document):
+    if isinstance(operand, dict):
+        operand = [operand['if'], operand['then'], operand['else']]
+    condition, then_value, else_value = operand
+    return _none_if_missing(evaluate(then_value if _truthy(evaluate(condition, document)) else else_value, document))
+
+
+def _if_null(operand, document):
+    *expressions, replacement = operand
+    for expression in expressions:
+        value = evaluate(expression, document)
+        if value is not None and value is not _MISSING:
+            return value
+    return evaluate(replacement, document)
+
+
+def _switch(operand, document):
+    for branch in operand['branches']:
+        if _truthy(evaluate(branch['case'], document)):
+            return evaluate(branch['then'], document)
+    if 'default' not in operand:
+        raise ValueError("$switch has no matching branch and no default")
+    return evaluate(operand['default'], document)
+
+
+def _compare(compare):
+    def operator(operand, document):
+        one, other = _arguments(operand, document)
+        return compare(sort_key(one), sort_key(other))
+    return operator
+
+
+def _array_accumulator(function):
+    """$sum, $avg, $min, $max as expressions: over an array argument or over several arguments"""
+    def operator(operand, document):
+        arguments = _arguments(operand, document)
+        if len(arguments) == 1 and isinstance(arguments[0], list):
+            arguments = arguments[0]
+        state = _ACCUMULATORS[function][0]()
+        for argument in arguments:
+            state = _ACCUMULATORS[function][1](state, argument)
+        return _ACCUMULATORS[function][2](state)
+    return operator
+
+
+def _date_part(attribute, transform=None):
+    def operator(operand, document):
+        value = evaluate(operand['date'] if isinstance(operand, dict) else operand, document)
+        if not isinstance(value, datetime):
+            return None
+        value = getattr(value, attribute)
+        return transform(value) if transform else value
+    return operator
+
+
+def _date_to_string(operand, document):
+    value = evaluate(operand['date'], document)
+    if not isinstance(value, datetime):
+        return None
+    date_format = operand.get('format', '%Y-%m-%dT%H:%M:%S.%LZ')
+    return value.strftime(date_format.replace('%L', f'{value.microsecond // 1000:03d}'))
+
+
+_OPERATORS = {
+    '$literal': lambda operand, document: operand,
+    '$cond': _cond,
+    '$ifNull': _if_null,
+    '$switch': _switch,
+    '$add': _arithmetic(_add),
+    '$subtract': _arithmetic(lambda one, other: one - other),
+    '$multiply': _arithmetic(_multiply),
+    '$divide': _arithmetic(lambda one, other: one / other),
+    '$mod': _arithmetic(lambda one, other: one % other),
+    '$abs': _arithmetic(abs),
+    '$trunc': _arithmetic(lambda value: float(int(value))),
+    '$concat': _arithmetic(lambda *strings: ''.join(strings)),
+    '$toLower': _arithmetic(lambda value: value.lower()),
+    '$toUpper': _arithmetic(lambda value: value.upper()),
+    '$size': lambda operand, document: len(_arguments(operand, document)[0]),
+    '$eq': _compare(lambda one, other: one == other),
+    '$ne': _compare(lambda one, other: one != other),
+    '$gt': _compare(lambda one, other: one > other),
+    '$gte': _compare(lambda one, other: one >= other),
+    '$lt': _compare(lambda one, other: one < other),
+    '$lte': _compare(lambda one, other: one <= other),
+    '$and': lambda operand, document: all(_truthy(evaluate(item, document)) for item in operand),
+    '$or': lambda operand, document: any(_truthy(evaluate(item, document)) for item in operand),
+    '$not': lambda operand, document: not _truthy(_arguments(operand, document)[0]),
+    '$in': lambda operand, document: _arguments(operand, document)[0] in _arguments(operand, document)[1],
+    '$sum': _array_accumulator('$sum'),
+    '$avg': _array_accumulator('$avg'),
+    '$min': _array_accumulator('$min'),
+    '$max': _array_accumulator('$max'),
+    '$year': _date_part('year'),
+    '$month': _date_part('month'),
+    '$dayOfMonth': _date_part('day'),
+    '$hour': _date_part('hour'),
+    '$minute': _date_part('minute'),
+    '$second': _date_part('second'),
+    '$millisecond': _date_part('microsecond', lambda value: value // 1000),
+    '$dateToString': _date_to_string,
+}
+
+
+# Accumulators of $group: (initial state, add value, state to result)
+
+def _sum(state, value):
+    if isinstance(value, Number) and not isinstance(value, bool):
+        return state + value
+    return state
+
+
+def _avg(state, value):
+    if isinstance(value, Number) and not isinstance(value, bool):
+        state[0] += value
+        state[1] += 1
+    return state
+
+
+def _extremum(is_better):
+    def accumulate(state, value):
+        if value is _MISSING or value is None:
+            return state
+        if state is _MISSING or is_better(sort_key(value), sort_key(state)):
+            return value
+        return state
+    return accumulate
+
+
+def _first(state, value):
+    return _none_if_missing(value) if state is _MISSING else state
+
+
+def _push(state, value):
+    if value is not _MISSING:
+        state.append(value)
+    return state
+
+
+def _add_to_set(state, value):
+    if value is not _MISSING:
+        state.setdefault(_freeze(value), value)
+    return state
+
+
+_ACCUMULATORS = {
+    '$sum': (int, _sum, lambda state: state),
+    '$avg': (lambda: [0, 0], _avg, lambda state: state[0] / state[1] if state[1] else None),
+    '$min': (lambda: _MISSING, _extremum(lambda one, other: one < other), _none_if_missing),
+    '$max': (lambda: _MISSING, _extremum(lambda one, other: one > other), _none_if_missing),
+    '$first': (lambda: _MISSING, _first, _none_if_missing),
+    '$last': (lambda: _MISSING, lambda state, value: _none_if_missing(value), _none_if_missing),
+    '$push': (list, _push, lambda state: state),
+    '$addToSet': (dict, _add_to_set, lambda state: list(state.values())),
+}
+
+
+# $project
+
+def project_document(document, specification):
+    """
+    Applies $project specification to the document
+
+    >>> project_document({'_id': 1, 'a': {'b': 1, 'c': 2}, 'd': 3}, {'a.b': 1, 'e': '$d'})
+    {'_id': 1, 'a': {'b': 1}, 'e': 3}
+    >>> project_document({'_id': 1, 'a': {'b': 1, 'c': 2}, 'd': 3}, {'a.c': 0, '_id': 0})
+    {'a': {'b': 1}, 'd': 3}
+    """
+    return compile_projection(specification)(document)
+
+
+def compile_projection(specification):
+    """Function applying $project specification to a document"""
+    specification = _expand(specification)
+    exclusion = any(_is_exclusion(value) for field, value in specification.items() if field != '_id') or (
+        list(specification) == ['_id'] and _is_exclusion(specification['_id'])
+    )
+    if exclusion:
+        return partial(_exclude, specification=specification)
+    if '_id' not in specification:
+        specification = {'_id': True, **specification}
+    compiled = _compile_inclusion(specification)
+    return lambda document: _include(document, document, compiled)
+
+
+def _expand(specification):
+    """Converts dotted keys of specification to nested dicts"""
+    expanded = {}
+    for field, value in specification.items():
+        step, _, rest = field.partition('.')
+        if rest:
+            nested = expanded.setdefault(step, {})
+            if isinstance(nested, dict):
+                nested.update(_expand({rest: value}))
+        elif isinstance(value, dict) and value and not any(key.startswith('$') for key in value):
+            expanded.setdefault(step, {})
+            expanded[step].update(_expand(value))
+        else:
+            expanded[step] = value
+    return expanded
+
+
+def _is_exclusion(value):
+    if _is_projection(value):
+        return any(_is_exclusion(item) for item in value.values())
+    return value is False or (isinstance(value, Number) and not isinstance(value, bool) and value == 0)
+
+
+def _is_inclusion(value):
+    return value is True or (isinstance(value, Number) and not isinstance(value, bool) and value != 0)
+
+
+def _is_projection(value):
+    """Nested projection specification: {'a': {'b': 1}}"""
+    return isinstance(value, dict) and bool(value) and not any(key.startswith('$') for key in value)
+
+
+def _compile_inclusion(specification):
+    """
+    Splits inclusion specification to included fields, nested projections and computed fields
+    """
+    rules = {}
+    computed = []
+    for field, rule in specification.items():
+        if _is_projection(rule):
+            nested = _compile_inclusion(rule)
+            rules[field] = nested
+            if _has_expressions(rule):
+                computed.append((field, nested))
+        elif _is_inclusion(rule):
+            rules[field] = True
+        elif not _is_exclusion(rule):
+            computed.append((field, rule))
+    return rules, computed
+
+
+def _include(root, document, compiled):
+    """
+    Included fields keep order of the document, computed fields follow them in order of the specification
+    """
+    rules, computed = compiled
+    result = {}
+    if isinstance(document, dict):
+        for field, value in document.items():
+            rule = rules.get(field)
+            if rule is True:
+                result[field] = value
+            elif rule is not None:
+                if isinstance(value, dict):
+                    result[field] = _include(root, value, rule)
+                elif isinstance(value, list):
+                    result[field] = [_include(root, item, rule) for item in value if isinstance(item, dict)]
+    for field, expression in computed:
+        if isinstance(expression, tuple):
+            if field not in result:
+                result[field] = _include(root, {}, expression)
+            continue
+        evaluated = evaluate(expression, root)
+        if evaluated is not _MISSING:
+            result[field] = evaluated
+    return result
+
+
+def _has_expressions(specification):
+    return any(
+        _has_expressions(value) if _is_projection(value) else not (_is_inclusion(value) or _is_exclusion(value))
+        for value in specification.values()
+    )
+
+
+def _exclude(document, specification):
+    if not isinstance(document, dict):
+        return document
+    result = {}
+    for field, value in document.items():
+        rule = specification.get(field, _MISSING)
+        if rule is _MISSING:
+            result[field] = value
+        elif isinstance(rule, dict):
+            if isinstance(value, list):
+                result[field] = [_exclude(item, rule) for item in value]
+            else:
+                result[field] = _exclude(value, rule)
+    return result
+
+
+# Ordering
+
+# Mongo comparison order of BSON types
+_TYPE_ORDER = ((type(None), 1), (bool, 8), (Number, 2), (str, 3), (dict, 4), (list, 5), (datetime, 9))
+
+
+def _type_bracket(value):
+    if value is _MISSING:
+        return 1
+    for value_type, order in _TYPE_ORDER:
+        if isinstance(value, value_type):
+            return order
+    return 10
+
+
+def sort_key(value):
+    """
+    Key of a value in Mongo order: null < numbers < strings < objects < arrays < booleans < dates
+
+    >>> sorted([True, 'a', None, 2, {'a': 1}, 1.5], key=sort_key)
+    [None, 1.5, 2, 'a', {'a': 1}, True]
+    """
+    bracket = _type_bracket(value)
+    if bracket == 1:
+        return (1,)
+    if bracket == 4:
+        return bracket, tuple((field, sort_key(item)) for field, item in value.items())
+    if bracket == 5:
+        return bracket, tuple(sort_key(item) for item in value)
+    if bracket == 10:
+        return bracket, repr(value)
+    return bracket, value
+
+
+def _freeze(value):
+    """Hashable representation of a value for grouping and $addToSet"""
+    if isinstance(value, dict):
+        return dict, tuple((field, _freeze(item)) for field, item in value.items())
+    if isinstance(value, list):
+        return list, tuple(_freeze(item) for item in value)
+    try:
+        hash(value)
+    except TypeError:
+        return type(value), repr(value)
+    return value
+
+
+if __name__ == '__main__':
+
+    def _test_module():
+        import doctest
+        result = doctest.testmod()
+        if not result.failed:
+            print(f"{result.attempted} passed and {result.failed} failed.\nTest passed.")
+
+    _test_module()
@@ -1,52 +1,165 @@
+import asyncio
+import inspect
 from functools import wraps
 
 
-def iterate_over(arg_name):
+def iterate_over(arg_name, concurrency=1):
     """
     Decorator, run function for elements of iterable argument
     Декоратор, применяющий функцию к элементам итерируемого аргумента.
+    Coroutine functions are decorated with coroutine function that awaits calls for elements,
+    no more than concurrency calls at a time. Their argument may be an async iterable.
+
+    >>> @iterate_over('number')
+    ... def show(number, prefix=''):
+    ...     print(prefix, number)
+    >>> show([1, 2], prefix='#')
+    # 1
+    # 2
+    >>> @iterate_over('number', concurrency=2)
+    ... async def show_later(number):
+    ...     await asyncio.sleep(0.01 * number)
+    ...     print(number)
+    >>> asyncio.run(show_later(number=[2, 1, 3]))
+    1
+    2
+    3
+
     :param arg_name: name of the function argument
     :type arg_name: str
+    :param concurrency: maximal number of simultaneous calls of coroutine function
     """
     def iterate_this(func):
         func.gw_method = func.__name__
 
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                iterable_arg, call = _iterable_arg_calls(func, arg_name, args, kwargs)
+                await _run_limited(call, iterable_arg, concurrency)
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            if arg_name in kwargs:
-                iterable_arg = kwargs[arg_name]
-                for item in iterable_arg:
-                    kwargs[arg_name] = item
-                    func(*args, **kwargs)
-            else:
-                index = func.__code__.co_varnames.index(arg_name)
-                iterable_arg = args[index]
-                for item in iterable_arg:
-                    new_args = tuple([item if i == index else arg for i, arg in enumerate(args)])
-                    func(*new_args, **kwargs)
+            iterable_arg, call = _iterable_arg_calls(func, arg_name, args, kwargs)
+            for item in iterable_arg:
+                call(item)
         return wrapper
     return iterate_this
 
 
+def _iterable_arg_calls(func, arg_name, args, kwargs):
+    """Returns value of iterable argument and function calling func for its element"""
+    if arg_name in kwargs:
+        def call(item):
+            return func(*args, **{**kwargs, arg_name: item})
+        return kwargs[arg_name], call
+
+    index = func.__code__.co_varnames.index(arg_name)
+
+    def call(item):
+        return func(*args[:index], item, *args[index + 1:], **kwargs)
+    return args[index], call
+
+
+async def _run_limited(call, iterable, concurrency=1):
+    """
+    Awaits call(item) for items of sync or async iterable, no more than concurrency at a time.
+    The first exception is raised, other running calls are cancelled and awaited.
+
+    >>> async def fail_fast():
+    ...     async def call(delay):
+    ...         await asyncio.sleep(delay)
+    ...         raise ValueError(delay)
+    ...     try:
+    ...         await _run_limited(call, [1, 0], concurrency=2)
+    ...     except ValueError as exc:
+    ...         return exc, len(asyncio.all_tasks())
+    >>> asyncio.run(fail_fast())
+    (ValueError(0), 1)
+    """
+    concurrency = max(concurrency or 1, 1)
+    running = set()
+
+    async def wait_first():
+        nonlocal running
+        done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        # Exceptions of all done tasks are retrieved, the first one is raised
+        for task in done:
+            if not task.cancelled():
+                task.exception()
+        for task in done:
+            task.result()
+
+    try:
+        if hasattr(iterable, '__aiter__'):
+            async for item in iterable:
+                if len(running) >= concurrency:
+                    await wait_first()
+                running.add(asyncio.ensure_future(call(item)))
+        else:
+            for item in iterable:
+                if len(running) >= concurrency:
+                    await wait_first()
+                running.add(asyncio.ensure_future(call(item)))
+        while running:
+            await wait_first()
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+
 def try_again(exceptions, retry_attempts=1, raise_exc=True):
     """
-    Decorator to re-run function if it fails with exception
+    Decorator to re-run function if it fails with exception.
+    Coroutine functions are decorated with coroutine function that re-awaits them.
+
+    >>> attempts = []
+    >>> @try_again(ValueError, retry_attempts=2)
+    ... async def fail_twice():
+    ...     attempts.append(1)
+    ...     if len(attempts) < 3:
+    ...         raise ValueError
+    ...     return len(attempts)
+    >>> asyncio.run(fail_twice())
+    3
     """
     def outer(fn):
         fn.gw_method = fn.__name__
+        _exceptions = _exceptions_tuple(exceptions)
+
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                for i in range(retry_attempts + 1):
+                    try:
+                        return await fn(*args, **kwargs)
+                    except Exception as exc:
+                        _raise_if_final(exc, _exceptions, i == retry_attempts and raise_exc)
+            return async_wrapper
 
         @wraps(fn)
         def wrapper(*args, **kwargs):
-            _exceptions = [exceptions] if issubclass(exceptions, Exception) else exceptions
-            _exceptions = tuple(_exceptions)
             for i in range(retry_attempts + 1):
                 try:
                     return fn(*args, **kwargs)
                 except Exception as exc:
-                    if not isinstance(exc, _exceptions):
-                        raise exc
-                    if raise_exc and i == retry_attempts:
-                        raise exc
-                    continue
+                    _raise_if_final(exc, _exceptions, i == retry_attempts and raise_exc)
         return wrapper
     return outer
+
+
+def _exceptions_tuple(exceptions):
+    if isinstance(exceptions, type) and issubclass(exceptions, Exception):
+        return (exceptions,)
+    return tuple(exceptions)
+
+
+def _raise_if_final(exc, exceptions, final):
+    """Re-raises exception that is not to be retried or failed the last attempt"""
+    if not isinstance(exc, exceptions):
+        raise exc
+    if final:
+        raise exc
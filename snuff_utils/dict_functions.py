@@ -64,6 +64,82 @@ def dict_copy(some_dict, fields=None, deep=False, **kwargs):
         return {field: value for field, value in result_dict.items() if field in fields}
 
 
+def compile_dict_copy(fields=None, deep=False, **kwargs):
+    """
+    Compiles dict_copy params to reusable DictProjector object.
+    Fields and renames are resolved once, only requested keys are looked up in copied dicts
+    (all keys are iterated for '*' fields only).
+
+    >>> rows = [{'a': 1, 'b': 2, 'c': 3}, {'a': 4, 'c': 6}]
+    >>> projector = compile_dict_copy('a,b', d='c')
+    >>> projector.copy(rows[0])
+    {'a': 1, 'b': 2, 'd': 3}
+    >>> list(projector.map(rows))
+    [{'a': 1, 'b': 2, 'd': 3}, {'a': 4, 'd': 6}]
+    >>> list(compile_dict_copy('*', d='c').map(rows))
+    [{'a': 1, 'b': 2, 'd': 3}, {'a': 4, 'd': 6}]
+    >>> compile_dict_copy('*', a='b', b='a')(rows[0])
+    {'b': 1, 'a': 2, 'c': 3}
+    >>> compile_dict_copy()(rows[1])
+    {'a': 4, 'c': 6}
+    >>> row = {'a': [1], 'b': 2}
+    >>> compile_dict_copy('a', deep=True).copy(row)['a'] is row['a']
+    False
+
+    :param fields: fields to copy, list or comma-separated string. '*' means all fields. All fields by default.
+    :param deep: Flag, copy values deeply
+    :param kwargs: renames of fields, {new name: source field}
+    :return: DictProjector
+    """
+    return DictProjector(fields, deep, **kwargs)
+
+
+class DictProjector(object):
+    """
+    Compiled dict_copy. Missing fields are skipped.
+    Copies of dicts have requested fields in order of fields and renamed fields after them
+    (dict_copy keeps order of source keys).
+    Renamed field is not copied under its own name. With '*' fields source keys equal to new names are skipped,
+    unless they are renamed themselves.
+    """
+
+    def __init__(self, fields=None, deep=False, **kwargs):
+        self.deep = deep
+        # New names by source fields
+        self.renames = dict_invert(kwargs)
+        # No fields and renames: plain copy of dict
+        self.plain_copy = not fields and not kwargs
+        # Source keys skipped with '*' fields (overwritten by renames), None for other fields
+        self.excluded = frozenset(kwargs) - frozenset(self.renames) if fields == '*' else None
+
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        if self.plain_copy or self.excluded is not None:
+            fields = []
+        # (source field, new name) pairs, duplicates removed
+        self.pairs = tuple(dict.fromkeys(
+            [(field, field) for field in fields or [] if field not in self.renames] + list(self.renames.items())
+        ))
+
+    def copy(self, some_dict):
+        """Returns copy of dict with requested fields"""
+        if self.plain_copy:
+            result_dict = some_dict.copy()
+        elif self.excluded is not None:
+            renames, excluded = self.renames, self.excluded
+            result_dict = {renames.get(field, field): value for field, value in some_dict.items()
+                           if field not in excluded}
+        else:
+            result_dict = {new_field: some_dict[field] for field, new_field in self.pairs if field in some_dict}
+        return deepcopy(result_dict) if self.deep else result_dict
+
+    __call__ = copy
+
+    def map(self, dicts):
+        """Iterates over copies of dicts"""
+        return map(self.copy, dicts)
+
+
 if __name__ == '__main__':
 
     def _test_module():
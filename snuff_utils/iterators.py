@@ -5,9 +5,14 @@
 Модуль с вспомогательными функциями-итераторами
 """
 
+import operator
+import re
+from collections import deque
 from collections.abc import Iterable
-
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import lru_cache
 from itertools import chain, islice
+from os import cpu_count
 
 
 def is_iterable(obj):
@@ -39,64 +44,690 @@ def iterate_over_hierarchy(value, hierarchy, hierarchy_separator='.', ignore_non
     >>> a = {'a': {'f': [{'f': [{'g': {'s': 3}}, {'g': [{'s': 5}, {'b': 3, 's': 89}]}]}]}}
     >>> list(iterate_over_hierarchy(a, 'a.f.f.g.s'))
     [3, 5, 89]
+    >>> list(iterate_over_hierarchy(a, 'a.f.f.g.b', ignore_nonexistent=False))
+    [None, None, 3]
     """
-    def has_attr(obj, attr):
-        if not obj:
-            return False
-        try:
-            return attr in obj
-        except:
-            return hasattr(obj, attr)
+    return compile_hierarchy(hierarchy, hierarchy_separator).iterate(value, ignore_nonexistent)
+
+
+def safe_get(obj, hierarchy, default=None, hierarchy_separator='.'):
+    """
+    Первое значение иерархии (см. iterate_over_hierarchy), либо default
+
+    >>> safe_get({'a': [{'b': 1}, {'b': 2}]}, 'a.1.b')
+    2
+    >>> safe_get({'a': [{'c': 1}, {'b': 2}]}, 'a.b')
+    2
+    >>> safe_get({'a': []}, 'a.0', 'default')
+    'default'
+    >>> safe_get({'a': {1: 'x'}}, ['a', 1]), list(iterate_over_hierarchy({'a': [{2: 'y'}]}, ['a', 2]))
+    ('x', ['y'])
+    """
+    return compile_hierarchy(hierarchy, hierarchy_separator).get(obj, default)
 
-    # Предварительное преобразование списка полей иерархии в список
-    if not isinstance(hierarchy, list):
+
+def compile_hierarchy(hierarchy, hierarchy_separator='.'):
+    """
+    Compiled accessor of the hierarchy (HierarchyPath). Compiled paths are kept in a bounded LRU cache,
+    so repeated calls with the same hierarchy skip parsing.
+
+    >>> path = compile_hierarchy('a.0.b')
+    >>> path.get({'a': [{'b': 1}]}), path({'a': []}, 'default')
+    (1, 'default')
+    >>> compile_hierarchy('a.0.b') is path
+    True
+    """
+    if isinstance(hierarchy, list):
+        hierarchy = tuple(hierarchy)
+    return _compile_hierarchy(hierarchy, hierarchy_separator)
+
+
+@lru_cache(maxsize=1024)
+def _compile_hierarchy(hierarchy, hierarchy_separator):
+    if isinstance(hierarchy, str):
         hierarchy = hierarchy.split(hierarchy_separator)
+    return HierarchyPath(hierarchy)
+
+
+class HierarchyPath(object):
+    """
+    Hierarchy of iterate_over_hierarchy, parsed once: steps and list indexes of digit steps.
+    get() walks dicts and indexed lists in a loop and falls back to iterate() only on lists without index.
+    iterate() traverses lists with an explicit stack instead of recursive generators.
+    """
+
+    __slots__ = ('steps', 'indexes')
+
+    def __init__(self, steps):
+        self.steps = tuple(steps)
+        self.indexes = tuple(map(_list_index, self.steps))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({'.'.join(map(str, self.steps))!r})"
+
+    def __call__(self, obj, default=None):
+        return self.get(obj, default)
+
+    def get(self, value, default=None):
+        """First value of the hierarchy, default if there is none"""
+        indexes = self.indexes
+        for i, step in enumerate(self.steps):
+            value_type = type(value)
+            if value_type is dict:
+                try:
+                    value = value[step]
+                except KeyError:
+                    return default
+            elif value_type is list and indexes[i] is not None:
+                if indexes[i] >= len(value):
+                    return default
+                value = value[indexes[i]]
+            else:
+                return next(self._iterate(value, i, True), default)
+        return value
+
+    def iterate(self, value, ignore_nonexistent=True):
+        """Iterates over values of the hierarchy, see iterate_over_hierarchy"""
+        return self._iterate(value, 0, ignore_nonexistent)
+
+    def _iterate(self, value, start, ignore_nonexistent):
+        steps, indexes = self.steps, self.indexes
+        last = len(steps) - 1
+        # Stack of (object, step position); list items are pushed in reverse order to keep depth-first order
+        stack = [(value, start)]
+        while stack:
+            value, i = stack.pop()
+            while True:
+                if isinstance(value, list):
+                    index = indexes[i]
+                    if index is None:
+                        stack.extend((item, i) for item in reversed(value))
+                        break
+                    if index >= len(value):
+                        if not ignore_nonexistent:
+                            yield None
+                        break
+                    value = value[index]
+                else:
+                    value = _step_value(value, steps[i])
+                    if value is _NOTHING:
+                        if not ignore_nonexistent:
+                            yield None
+                        break
+                if i == last:
+                    yield value
+                    break
+                i += 1
+
+
+class HierarchyExtractor(object):
+    """
+    Extracts values of many hierarchies (see iterate_over_hierarchy) walking the object once:
+    hierarchies are merged to a prefix tree, so shared prefixes are traversed once per object.
+
+    >>> extractor = HierarchyExtractor(['a.b', 'a.c', 'a.l.x', 'a.l.0.x', 'd'])
+    >>> obj = {'a': {'b': 1, 'l': [{'x': 1}, {'x': 2}, {'y': 3}]}, 'd': 4}
+    >>> extractor.extract(obj)
+    {'a.b': [1], 'a.c': [], 'a.l.x': [1, 2], 'a.l.0.x': [1], 'd': [4]}
+    >>> extractor.extract(obj, ignore_nonexistent=False)['a.l.x']
+    [1, 2, None]
+    >>> extractor.get(obj, default='-')
+    {'a.b': 1, 'a.c': '-', 'a.l.x': 1, 'a.l.0.x': 1, 'd': 4}
+    >>> [values['d'] for values in extractor.extract_many([obj, {'d': 5}])]
+    [[4], [5]]
+    >>> HierarchyExtractor([['a', 1]]).get({'a': {1: 'x'}})
+    {('a', 1): 'x'}
+    >>> HierarchyExtractor(['a.b']).extract({'a': 'abc'}, ignore_nonexistent=False)
+    {'a.b': [None]}
+    """
+
+    def __init__(self, hierarchies, hierarchy_separator='.'):
+        """
+        :param hierarchies: Hierarchies, list of strings or lists of fields
+        :param hierarchy_separator: Separator of string hierarchies
+        """
+        self.hierarchies = list(dict.fromkeys(
+            tuple(hierarchy) if isinstance(hierarchy, list) else hierarchy for hierarchy in hierarchies
+        ))
+        self.root = _HierarchyNode()
+        for i, hierarchy in enumerate(self.hierarchies):
+            node = self.root
+            for step in compile_hierarchy(hierarchy, hierarchy_separator).steps:
+                node = node.child(step)
+            node.ends.append(i)
+        self.root.freeze()
 
-    for i, field in enumerate(hierarchy):
-        # Получение элемента списка по индексу
-        if isinstance(value, list) and field.isdigit():
-            field = int(field)
-            # Если индекс больше длины списка
-            if field >= len(value):
-                if ignore_nonexistent: break
-                yield None
-                break
-
-        # Цикл по списку
-        elif isinstance(value, list):
-            for item in value:
-                for result in iterate_over_hierarchy(item, hierarchy[i:], hierarchy_separator, ignore_nonexistent):
-                    yield result
-            break
-
-        # Если поле отсутствует
-        elif not has_attr(value, field):
-            if ignore_nonexistent: break
-            yield None
-            break
-
-        # Ступаем на уровень ниже
+    def extract(self, obj, ignore_nonexistent=True):
+        """All values of every hierarchy: dict of hierarchy -> list of values"""
+        return dict(zip(self.hierarchies, self._walk(obj, ignore_nonexistent, False)))
+
+    def get(self, obj, default=None):
+        """The first value of every hierarchy (as safe_get does): dict of hierarchy -> value or default"""
+        return {
+            hierarchy: values[0] if values else default
+            for hierarchy, values in zip(self.hierarchies, self._walk(obj, True, True))
+        }
+
+    def extract_many(self, objects, ignore_nonexistent=True):
+        """Iterates over extract() results of objects"""
+        for obj in objects:
+            yield self.extract(obj, ignore_nonexistent)
+
+    def get_many(self, objects, default=None):
+        """Iterates over get() results of objects"""
+        for obj in objects:
+            yield self.get(obj, default)
+
+    def _walk(self, obj, ignore_nonexistent, first_only):
+        """
+        Lists of values of hierarchies, in order of self.hierarchies.
+        Values of every hierarchy are in iterate_over_hierarchy order: the traversal is depth-first.
+        In first_only mode subtrees whose hierarchies already have a value are skipped.
+        """
+        results = [[] for _ in self.hierarchies]
+        # Stack of (object, edges, fanned out): steps of the edges are to be applied to the object.
+        # Hierarchies get more than one value only by fan-out over lists, so only list items are pruned.
+        stack = [(obj, self.root.edges, False)]
+        while stack:
+            value, edges, fanned_out = stack.pop()
+            if fanned_out and first_only and all(results[i] for edge in edges for i in edge[2].subtree):
+                continue
+            fan_out_edges = []
+            for edge in edges:
+                step, index, node = edge
+                if type(value) is dict:
+                    child = value.get(step, _NOTHING)
+                    if child is _NOTHING:
+                        if not ignore_nonexistent:
+                            for i in node.subtree:
+                                results[i].append(None)
+                        continue
+                elif isinstance(value, list):
+                    if index is None:
+                        fan_out_edges.append(edge)
+                        continue
+                    if index >= len(value):
+                        if not ignore_nonexistent:
+                            for i in node.subtree:
+                                results[i].append(None)
+                        continue
+                    child = value[index]
+                else:
+                    child = _step_value(value, step)
+                    if child is _NOTHING:
+                        if not ignore_nonexistent:
+                            for i in node.subtree:
+                                results[i].append(None)
+                        continue
+                for i in node.ends:
+                    results[i].append(child)
+                if node.edges:
+                    stack.append((child, node.edges, False))
+            if fan_out_edges:
+                fan_out_edges = tuple(fan_out_edges)
+                stack.extend((item, fan_out_edges, True) for item in reversed(value))
+        return results
+
+
+_NOTHING = object()
+
+
+class _HierarchyNode(object):
+    """Node of HierarchyExtractor prefix tree"""
+
+    __slots__ = ('children', 'ends', 'edges', 'subtree')
+
+    def __init__(self):
+        self.children = {}
+        # Positions of hierarchies ending at the node and of hierarchies of the whole subtree
+        self.ends = []
+        self.edges = ()
+        self.subtree = ()
+
+    def child(self, step):
+        if step not in self.children:
+            self.children[step] = _HierarchyNode()
+        return self.children[step]
+
+    def freeze(self):
+        """Prepares edges (step, list index, node) and subtree hierarchies for traversal"""
+        subtree = list(self.ends)
+        edges = []
+        for step, node in self.children.items():
+            node.freeze()
+            subtree.extend(node.subtree)
+            edges.append((step, _list_index(step), node))
+        self.edges = tuple(edges)
+        self.subtree = tuple(subtree)
+
+
+def _list_index(step):
+    """List index of a hierarchy step: digit strings select list items, other steps (int dict keys too) don't"""
+    return int(step) if isinstance(step, str) and step.isdigit() else None
+
+
+def _has_attr(obj, attr):
+    if not obj:
+        return False
+    try:
+        return attr in obj
+    except:
+        return hasattr(obj, attr)
+
+
+def _step_value(value, step):
+    """Item or attribute of a non-list object by the hierarchy step, _NOTHING if there is none"""
+    if not _has_attr(value, step):
+        return _NOTHING
+    try:
+        return value[step]
+    except Exception:
+        # Container of the step that has no items (a string), or object with attribute
+        return getattr(value, step, _NOTHING)
+
+
+def iterate_over_query(value, query):
+    """
+    Iterates over values selected by the extended hierarchy query (see compile_query)
+
+    >>> order = {'items': [{'status': 'active', 'amount': 5}, {'status': 'new', 'amount': 7},
+    ...                    {'status': 'active', 'amount': 1, 'tags': ['x']}]}
+    >>> list(iterate_over_query(order, 'items[?status=active].amount'))
+    [5, 1]
+    >>> list(iterate_over_query(order, 'items.1:.amount')), list(iterate_over_query(order, 'items[-1].amount'))
+    ([7, 1], [1])
+    >>> list(iterate_over_query(order, 'items[?amount>=5][?tags].amount')), list(iterate_over_query(order, 'items.*.tags'))
+    ([], [['x']])
+    >>> list(iterate_over_query(order, 'items[?status=active][-1].amount'))
+    [1]
+    >>> list(iterate_over_query({'a': 'abc'}, 'a.b'))
+    []
+    >>> list(iterate_over_query(order, 'items[?status=active]amount'))
+    Traceback (most recent call last):
+    ...
+    ValueError: Unexpected text after brackets in query step 'items[?status=active]amount'
+    """
+    return compile_query(query).iterate(value)
+
+
+@lru_cache(maxsize=1024)
+def compile_query(query, separator='.'):
+    """
+    Compiles extended hierarchy query to a reusable HierarchyQuery (kept in a bounded LRU cache).
+
+    Query is a hierarchy of iterate_over_hierarchy (steps separated by separator) with additional steps:
+        0:10, ::2, -3:  - slice of a list (fan-out over the slice items)
+        *               - fan-out over values of a dict or items of a list
+        [?field=value]  - filter: list items (or the object itself) matching the predicate.
+                          Operators: =, !=, >, >=, <, <=; [?field] checks existence.
+                          Field is a hierarchy, predicate matches if any of its values matches.
+                          Value is a number, true, false, null, quoted or plain string.
+        [1], [-1], [1:3], [*] - index, slice and wildcard in brackets
+    Brackets follow a step or each other: items[?status=active][0].amount
+    Index, slice and filter after a slice or filter are applied to the selected list,
+    other steps are applied to every selected item.
+    """
+    return HierarchyQuery(_parse_query(query, separator))
+
+
+class HierarchyQuery(object):
+    """
+    Compiled extended hierarchy query. Filters are applied during the traversal,
+    so subtrees of non-matching items are never visited. The traversal uses an explicit stack.
+    """
+
+    __slots__ = ('steps',)
+
+    def __init__(self, steps):
+        self.steps = tuple(steps)
+
+    def __call__(self, obj, default=None):
+        return self.get(obj, default)
+
+    def get(self, obj, default=None):
+        """The first selected value or default"""
+        return next(self.iterate(obj), default)
+
+    def iterate(self, value):
+        """Iterates over selected values in depth-first order"""
+        steps = self.steps
+        last = len(steps)
+        stack = [(value, 0)]
+        while stack:
+            value, i = stack.pop()
+            if i == last:
+                yield value
+                continue
+            kind, argument = steps[i]
+            if kind is _KEY:
+                step, index = argument
+                if isinstance(value, list):
+                    if index is None:
+                        stack.extend((item, i) for item in reversed(value))
+                    elif index < len(value):
+                        stack.append((value[index], i + 1))
+                else:
+                    value = _step_value(value, step)
+                    if value is not _NOTHING:
+                        stack.append((value, i + 1))
+            elif kind is _INDEX:
+                if isinstance(value, list) and -len(value) <= argument < len(value):
+                    stack.append((value[argument], i + 1))
+            elif kind is _SLICE:
+                if isinstance(value, list):
+                    if i + 1 < last and steps[i + 1][0] in _LIST_STEPS:
+                        stack.append((value[argument], i + 1))
+                    else:
+                        stack.extend((item, i + 1) for item in reversed(value[argument]))
+            elif kind is _WILDCARD:
+                if isinstance(value, dict):
+                    stack.extend((item, i + 1) for item in reversed(list(value.values())))
+                elif isinstance(value, list):
+                    stack.extend((item, i + 1) for item in reversed(value))
+            elif isinstance(value, list):
+                if i + 1 < last and steps[i + 1][0] in _LIST_STEPS:
+                    stack.append(([item for item in value if argument(item)], i + 1))
+                else:
+                    stack.extend((item, i + 1) for item in reversed(value) if argument(item))
+            elif argument(value):
+                stack.append((value, i + 1))
+
+
+_KEY, _INDEX, _SLICE, _WILDCARD, _FILTER = 'key', 'index', 'slice', 'wildcard', 'filter'
+# Steps applied to the whole list selected by a previous slice or filter, not to its items
+_LIST_STEPS = (_INDEX, _SLICE, _FILTER)
+
+_SLICE_PATTERN = re.compile(r'^(-?\d*):(-?\d*)(?::(-?\d*))?$')
+_INDEX_PATTERN = re.compile(r'^-?\d+$')
+_PREDICATE_PATTERN = re.compile(r'^\?\s*([^!=<>]+?)\s*(?:(!=|>=|<=|=|>|<)\s*(.*?))?\s*$')
+
+
+def _parse_query(query, separator):
+    """Splits query to steps: (kind, argument)"""
+    steps = []
+    for segment in _split_query(query, separator):
+        name, _, brackets = segment.partition('[')
+        if name or not brackets:
+            steps.append(_parse_step(name))
+        if brackets:
+            if not brackets.endswith(']'):
+                raise ValueError(f"Unexpected text after brackets in query step {segment!r}")
+            for expression in ('[' + brackets)[1:-1].split(']['):
+                steps.append(_parse_bracket(expression))
+    return steps
+
+
+def _split_query(query, separator):
+    """Splits query by separator outside of brackets"""
+    segments, current, depth = [], [], 0
+    for char in query:
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        if char == separator and not depth:
+            segments.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    if depth:
+        raise ValueError(f"Unbalanced brackets in query {query!r}")
+    segments.append(''.join(current))
+    return segments
+
+
+def _parse_step(step):
+    if step == '*':
+        return _WILDCARD, None
+    if ':' in step and _SLICE_PATTERN.match(step):
+        return _SLICE, _parse_slice(step)
+    return _KEY, (step, _list_index(step))
+
+
+def _parse_bracket(expression):
+    expression = expression.strip()
+    if expression.startswith('?'):
+        return _FILTER, _parse_predicate(expression)
+    if expression == '*':
+        return _WILDCARD, None
+    if _INDEX_PATTERN.match(expression):
+        return _INDEX, int(expression)
+    if _SLICE_PATTERN.match(expression):
+        return _SLICE, _parse_slice(expression)
+    raise ValueError(f"Unsupported query expression [{expression}]")
+
+
+def _parse_slice(expression):
+    return slice(*(int(part) if part else None for part in _SLICE_PATTERN.match(expression).groups()))
+
+
+def _parse_predicate(expression):
+    match = _PREDICATE_PATTERN.match(expression)
+    if not match:
+        raise ValueError(f"Unsupported query predicate [{expression}]")
+    field, sign, value = match.groups()
+    path = compile_hierarchy(field.strip())
+    if sign is None:
+        return lambda obj: next(path.iterate(obj), _NOTHING) is not _NOTHING
+    compare = _PREDICATE_OPERATORS[sign]
+    value = _parse_literal(value)
+
+    def predicate(obj):
+        for field_value in path.iterate(obj):
+            try:
+                if compare(field_value, value):
+                    return True
+            except TypeError:
+                continue
+        return False
+    return predicate
+
+
+def _parse_literal(value):
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '\'"':
+        return value[1:-1]
+    if value in _LITERALS:
+        return _LITERALS[value]
+    for convert in (int, float):
         try:
-            value = value[field]
-        except:
-            value = getattr(value, field)
+            return convert(value)
+        except ValueError:
+            pass
+    return value
 
-        # Обработка последнего уровня иерерахии
-        if i + 1 == len(hierarchy):
-            yield value
-            break
 
+_LITERALS = {'true': True, 'false': False, 'null': None}
 
-def safe_get(obj, hierarchy, default=None, hierarchy_separator='.'):
-    return next(iterate_over_hierarchy(obj, hierarchy, hierarchy_separator=hierarchy_separator), default)
+_PREDICATE_OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
 
 
 def chunks(iterable, n):
     """Yield n-sized iterators from iterable.
-    Use map(list, chunks(...)) for list chunks."""
+    Use map(list, chunks(...)) for list chunks.
+    Every chunk must be consumed before the next one is taken.
+
+    >>> list(map(list, chunks(range(5), 2)))
+    [[0, 1], [2, 3], [4]]
+    >>> list(chunks([], 2))
+    []
+    """
     iterator = iter(iterable)
     while True:
-        yield chain((next(iterator),), islice(iterator, n-1))
+        try:
+            first = next(iterator)
+        except StopIteration:
+            return
+        yield chain((first,), islice(iterator, n-1))
+
+
+def list_chunks(iterable, n):
+    """
+    Yield n-sized lists from iterable. Unlike chunks, chunks are independent of each other.
+    Lists and tuples are sliced, other iterables are read with islice.
+
+    >>> list(list_chunks(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    >>> list(list_chunks((0, 1, 2), 2))
+    [[0, 1], [2]]
+    """
+    return _materialized_chunks(iterable, n, list)
+
+
+def tuple_chunks(iterable, n):
+    """
+    Yield n-sized tuples from iterable, see list_chunks
+
+    >>> list(tuple_chunks(iter('abc'), 2))
+    [('a', 'b'), ('c',)]
+    """
+    return _materialized_chunks(iterable, n, tuple)
+
+
+def _materialized_chunks(iterable, n, container):
+    if n < 1:
+        raise ValueError('Chunk size must be positive')
+    if isinstance(iterable, container):
+        for start in range(0, len(iterable), n):
+            yield iterable[start:start + n]
+    elif isinstance(iterable, (list, tuple)):
+        for start in range(0, len(iterable), n):
+            yield container(iterable[start:start + n])
+    else:
+        iterator = iter(iterable)
+        yield from iter(lambda: container(islice(iterator, n)), container())
+
+
+def weighted_chunks(iterable, max_weight, weight=len, max_items=None):
+    """
+    Yield lists of items with total weight not exceeding max_weight,
+    for example documents of Mongo bulk writes by BSON size or emails of SMTP batches by message size.
+    An item heavier than max_weight makes a chunk of its own.
+
+    >>> list(weighted_chunks(['ab', 'c', 'def', 'ghijk', 'l'], 4))
+    [['ab', 'c'], ['def'], ['ghijk'], ['l']]
+    >>> list(weighted_chunks(range(1, 6), 100, weight=int, max_items=2))
+    [[1, 2], [3, 4], [5]]
+    >>> list(weighted_chunks(['ab', 'вг', 'd'], 4, weight=lambda s: len(s.encode())))
+    [['ab'], ['вг'], ['d']]
+
+    :param iterable: Items
+    :param max_weight: Maximal total weight of a chunk
+    :param weight: Function of item weight, len by default: bytes of bytes, but characters of strings.
+        Use weight=lambda s: len(s.encode()) for a byte budget of strings.
+    :param max_items: Maximal number of items in a chunk, unlimited by default
+    """
+    chunk, chunk_weight = [], 0
+    for item in iterable:
+        item_weight = weight(item)
+        if chunk and (chunk_weight + item_weight > max_weight or len(chunk) == max_items):
+            yield chunk
+            chunk, chunk_weight = [], 0
+        chunk.append(item)
+        chunk_weight += item_weight
+    if chunk:
+        yield chunk
+
+
+async def async_chunks(iterable, n):
+    """
+    Yield n-sized lists from async (or sync) iterable
+
+    >>> import asyncio
+    >>> async def numbers():
+    ...     for i in range(5):
+    ...         yield i
+    >>> async def collect():
+    ...     return [chunk async for chunk in async_chunks(numbers(), 2)]
+    >>> asyncio.run(collect())
+    [[0, 1], [2, 3], [4]]
+    """
+    if n < 1:
+        raise ValueError('Chunk size must be positive')
+    if not hasattr(iterable, '__aiter__'):
+        for chunk in list_chunks(iterable, n):
+            yield chunk
+        return
+    chunk = []
+    async for item in iterable:
+        chunk.append(item)
+        if len(chunk) == n:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parallel_map(func, iterable, workers=None, mode='thread', ordered=True, max_in_flight=None, cancel=None,
+                 initializer=None, initargs=()):
+    """
+    Yields func results for items of iterable, calling func in a thread or process pool.
+    No more than max_in_flight items are read ahead of the consumer, so huge and infinite sources
+    are processed in constant memory. An exception of func is raised to the consumer, pending calls are cancelled.
+
+    >>> list(parallel_map(abs, range(-3, 3), workers=2))
+    [3, 2, 1, 0, 1, 2]
+    >>> sorted(parallel_map(abs, range(-3, 3), ordered=False))
+    [0, 1, 1, 2, 2, 3]
+    >>> list(parallel_map(int, ['1', 'x']))
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid literal for int() with base 10: 'x'
+
+    :param func: Function of one argument. Must be picklable in process mode.
+    :param iterable: Items
+    :param workers: Number of threads or processes. By default as in concurrent.futures executors.
+    :param mode: 'thread' (I/O bound functions) or 'process' (CPU bound functions)
+    :param ordered: Flag, yield results in order of items. Otherwise in order of completion.
+    :param max_in_flight: Maximal number of submitted but not yielded items, two per worker by default
+    :param cancel: Flag object (graceful_exit.graceful_exit for example): if it becomes true,
+    no more items are submitted and iteration stops
+    :param initializer: Function called with initargs at start of every worker, e.g. to pass large shared data
+    to processes once instead of with every item
+    :param initargs: Arguments of initializer
+    """
+    if mode not in _EXECUTORS:
+        raise ValueError(f"mode must be one of {', '.join(_EXECUTORS)}, not {mode!r}")
+    if not workers:
+        workers = cpu_count() or 1
+        if mode == 'thread':
+            workers = min(32, workers + 4)
+    max_in_flight = max(max_in_flight or workers * 2, 1)
+
+    iterator = iter(iterable)
+    executor = _EXECUTORS[mode](max_workers=workers, initializer=initializer, initargs=initargs)
+    in_flight = deque() if ordered else set()
+    submit = in_flight.append if ordered else in_flight.add
+    try:
+        for item in islice(iterator, max_in_flight):
+            submit(executor.submit(func, item))
+        while in_flight:
+            if cancel:
+                return
+            if ordered:
+                future = in_flight.popleft()
+            else:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                future = done.pop()
+                in_flight.remove(future)
+            result = future.result()
+            if not cancel:
+                for item in islice(iterator, 1):
+                    submit(executor.submit(func, item))
+            yield result
+    finally:
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+_EXECUTORS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
 
 
 if __name__ == '__main__':
@@ -3,14 +3,28 @@
 
 """Модуль для функций обработки списка словарей"""
 
-from copy import deepcopy
-from operator import eq, ne, contains
+import pickle
+import random
+from bisect import bisect_left, bisect_right
+from copy import copy
+from functools import partial
+from heapq import heappush, heapreplace, merge, nlargest, nsmallest
+from itertools import chain, compress, islice, product, tee
+from operator import add, eq, itemgetter, methodcaller, ne
+from os import cpu_count
+from tempfile import TemporaryFile
 
 try:
+    from .iterators import compile_hierarchy, list_chunks, parallel_map
     from .universal import str_to_list
 except:
+    from snuff_utils.iterators import compile_hierarchy, list_chunks, parallel_map
     from snuff_utils.universal import str_to_list
 
+# Default minimal number of source rows to start a process pool in parallel mode of filter, map and group:
+# smaller sources are processed in the current process faster than rows are sent to workers
+PARALLEL_THRESHOLD = 100000
+
 
 def find_dict_in_list(list_of_dicts, values_dict=None, by_fields='',
                       default='$nodefaultvalue$', **kwargs):
@@ -53,102 +67,662 @@ def find_dict_in_list(list_of_dicts, values_dict=None, by_fields='',
 
     >>> next(find_dict_in_list([{'a': 1}], a__nin=[2, 4]), None)
     {'a': 1}
+    >>> list(find_dict_in_list([{'a': [1]}, {'a': 2}, {'a': [2]}], a__in=[[1], 2]))
+    [{'a': [1]}, {'a': 2}]
+    >>> list(find_dict_in_list([{'a': [1]}], a__in=[2]))
+    []
+    >>> next(find_dict_in_list([{'a': 1}], a__in=5), None)
+    Traceback (most recent call last):
+    ...
+    TypeError: argument of type 'int' is not iterable
+    >>> list(find_dict_in_list([{'a': 1}, {'a': 2}, {'a': 3}, {'a': None}], a__gt=1, a__lte=3))
+    [{'a': 2}, {'a': 3}]
+    >>> list(find_dict_in_list([{'a': 1}, {'a': 'b'}, {}], a__gte=1, a__lt=2))
+    [{'a': 1}]
+    >>> list(find_dict_in_list([{'a': {'b': 1}}, {'a': {'b': 2}}, {'a': 1}], {'a.b__gt': 1}))
+    [{'a': {'b': 2}}]
     """
-    values_dict = deepcopy(values_dict)
-    if not values_dict:
-        values_dict = {}
+    dict_filter = compile_filter(values_dict, by_fields, **kwargs)
+    # Filter by fields absent in values_dict, nothing to search
+    if dict_filter.conditions is None:
+        return
 
-    if kwargs and isinstance(values_dict, dict):
-        values_dict.update(kwargs)
-    elif kwargs:
-        for field, value in kwargs.items():
-            values_dict[field] = value
+    any_matches = False
+    for _dict in dict_filter.filter(list_of_dicts):
+        # совпадение - словарь
+        yield _dict
+        any_matches = True
 
-    if not by_fields:
-        by_fields = values_dict.keys()
-    by_fields = str_to_list(by_fields)
+    # Если нет совпадений и задано значение по умолчанию
+    if not any_matches and default != '$nodefaultvalue$':
+        yield default
 
-    if not all(field in values_dict for field in by_fields):
-        return
 
-    def field_exists(obj, field):
-        exists = hasattr(obj, field)
-        if exists:
-            return True
-        try:
-            return field in obj
-        except Exception as exc:
-            return False
+def compile_filter(values_dict=None, by_fields='', **kwargs):
+    """
+    Compiles find_dict_in_list filter to reusable DictFilter object.
+    Operators are parsed once, hashable __in/__nin operands are converted to frozensets.
+
+    >>> rows = [{'a': 1, 'b': 'x'}, {'a': 2}, {'a': 3, 'b': 'y'}]
+    >>> dict_filter = compile_filter(a__in=[1, 3], b__ne='y')
+    >>> dict_filter.match(rows[0])
+    True
+    >>> list(dict_filter.filter(rows))
+    [{'a': 1, 'b': 'x'}]
+    >>> compile_filter({'a': 3, 'b': 'x'}, by_fields='a').first(rows)
+    {'a': 3, 'b': 'y'}
+    >>> compile_filter(a__nin=(1, 2), b__type=str).first(rows[:2], 'nothing')
+    'nothing'
+    >>> compile_filter(a__in=[[1], 2]).first([{'a': [1]}])
+    {'a': [1]}
 
-    def get_value(obj, field):
-        return obj[field] if isinstance(obj, dict) else getattr(obj, field)
+    :param values_dict: dict of filter values
+    :param by_fields: fields of values_dict to filter by. All fields by default.
+    :param kwargs: filter values, update values_dict
+    :return: DictFilter
+    """
+    return DictFilter(values_dict, by_fields, **kwargs)
 
-    operators_map = {
-        '__eq': eq,
-        '__ne': ne,
-        '__type': isinstance,
-        '__in': lambda x, y: contains(y, x),
-        '__nin': lambda x, y: not contains(y, x),
-    }
-    operators_allow_nonexistence = [ne]
 
-    any_matches = False
-    for _dict in list_of_dicts:
-        for field in by_fields:
-            is_obj_check = False
-            target_field = field
-            for ending, operator in operators_map.items():
-                if not field.endswith(ending):
-                    continue
-                field = field[:-len(ending)]
-                is_obj_check = not bool(field)
-                break
-            else:
-                operator = eq
+class DictFilter(object):
+    """
+    Compiled filter of find_dict_in_list.
+    Field names may end with operators: __eq, __ne, __type, __in, __nin, __gt, __gte, __lt, __lte.
+    Range operators don't match missing fields and values incomparable with the bound.
+    Operator without field name (__type=dict) is applied to the object itself.
+    Field names may be dotted paths to nested values ('client.address.city'), see _PathGetter.
+    """
 
-            # Получаем сравниваемые значения
-            target_value = get_value(values_dict, target_field)
+    def __init__(self, values_dict=None, by_fields='', **kwargs):
+        values_dict = copy(values_dict)
+        if not values_dict:
+            values_dict = {}
 
-            if is_obj_check:
-                if operator(_dict, target_value):
+        if kwargs and isinstance(values_dict, dict):
+            values_dict.update(kwargs)
+        elif kwargs:
+            for field, value in kwargs.items():
+                values_dict[field] = value
+
+        if not by_fields:
+            by_fields = values_dict.keys()
+        by_fields = str_to_list(by_fields)
+
+        # Conditions: (field, operator, value, field getter). Field is empty for checks of object itself.
+        # None if some of by_fields are absent in values_dict, such filter matches nothing.
+        self.conditions = None
+        if not all(field in values_dict for field in by_fields):
+            return
+
+        self.conditions = []
+        for target_field in by_fields:
+            field, operator = target_field, eq
+            for ending, ending_operator in _FILTER_OPERATORS:
+                if field.endswith(ending):
+                    field, operator = field[:-len(ending)], ending_operator
+                    break
+            value = _get_value(values_dict, target_field)
+            if operator in (_in, _not_in):
+                value = _frozen(value)
+            self.conditions.append((field, operator, value, _field_getter(field) if field else None))
+
+    def match(self, obj):
+        """Checks if object matches the filter"""
+        if self.conditions is None:
+            return False
+        for field, operator, value, getter in self.conditions:
+            if not field:
+                if operator(obj, value):
                     continue
-                break
+                return False
 
+            field_value = getter(obj)
             # Проверяем, что поле существует внутри объекта
-            exists = field_exists(_dict, field)
-            # для некоторых операторов допустимо отсутствие поля
-            if not exists and operator in operators_allow_nonexistence:
+            if field_value is _MISSING:
+                # для некоторых операторов допустимо отсутствие поля
+                if operator is ne:
+                    continue
+                return False
+
+            if not operator(field_value, value):
+                return False
+        return True
+
+    def filter(self, rows):
+        """Iterates over matching rows"""
+        return filter(self.match, rows)
+
+    def first(self, rows, default=None):
+        """Returns the first matching row or default"""
+        return next(self.filter(rows), default)
+
+
+def filter_list_of_dicts(list_of_dicts, dict_filter, parallel=False, workers=None, chunk_size=10000,
+                         parallel_threshold=PARALLEL_THRESHOLD):
+    """
+    Iterates over rows matching the filter, in the source order.
+
+    >>> rows = [{'a': i % 3, 'b': i} for i in range(10)]
+    >>> [row['b'] for row in filter_list_of_dicts(rows, {'a': 1, 'b__gt': 3})]
+    [4, 7]
+    >>> dict_filter = compile_filter(a__in=[0, 2])
+    >>> [row['b'] for row in filter_list_of_dicts(rows, dict_filter, parallel=True, workers=2, chunk_size=3,
+    ...                                            parallel_threshold=0)]
+    [0, 2, 3, 5, 6, 8, 9]
+
+    In parallel mode the source is split into chunk_size-sized chunks (iterators.list_chunks),
+    the filter is matched in a process pool, and the source rows themselves (not copies) are yielded.
+    Sources shorter than parallel_threshold rows are filtered in the current process.
+
+    :param list_of_dicts: Iterable of dicts
+    :param dict_filter: DictFilter (compile_filter) or values_dict of find_dict_in_list
+    :param parallel: Flag, match chunks in a process pool
+    :param workers: Number of processes. CPU count by default
+    :param chunk_size: Size of chunk for a pool task
+    :param parallel_threshold: Minimal number of rows to start a process pool
+    """
+    if not isinstance(dict_filter, DictFilter):
+        dict_filter = DictFilter(dict_filter)
+    if dict_filter.conditions is None:
+        return iter(())
+    if not parallel:
+        return dict_filter.filter(list_of_dicts)
+    filter_chunk = partial(_filter_chunk, dict_filter)
+    return chain.from_iterable(
+        map(chunk.__getitem__, positions)
+        for chunk, positions in _imap_chunks(filter_chunk, list_of_dicts, chunk_size, workers, parallel_threshold)
+    )
+
+
+def map_list_of_dicts(func, list_of_dicts, parallel=False, workers=None, chunk_size=10000,
+                      parallel_threshold=PARALLEL_THRESHOLD):
+    """
+    Iterates over func results for rows, in the source order.
+    In parallel mode func is applied to chunks of the source in a process pool, so func and its results
+    must be picklable (module-level function, partial of it, compiled filter, etc.).
+    Sources shorter than parallel_threshold rows are processed in the current process.
+
+    >>> list(map_list_of_dicts(methodcaller('get', 'a'), [{'a': 1}, {}]))
+    [1, None]
+    >>> list(map_list_of_dicts(compile_filter(a=1).match, [{'a': 1}, {'a': 2}, {'a': 1}],
+    ...                        parallel=True, workers=2, chunk_size=1, parallel_threshold=0))
+    [True, False, True]
+    """
+    if not parallel:
+        return map(func, list_of_dicts)
+    map_chunk = partial(_map_chunk, func)
+    return chain.from_iterable(
+        results for _, results in _imap_chunks(map_chunk, list_of_dicts, chunk_size, workers, parallel_threshold)
+    )
+
+
+def _in(value, values):
+    """Membership of value in __in/__nin operand. Non-container operand raises TypeError."""
+    if isinstance(values, frozenset):
+        try:
+            return value in values
+        except TypeError:
+            # Unhashable value and operand converted to frozenset by _frozen: compared as with a list
+            return any(item == value for item in values)
+    return value in values
+
+
+def _not_in(value, values):
+    return not _in(value, values)
+
+
+def _gt(value, bound):
+    try:
+        return value > bound
+    except TypeError:
+        return False
+
+
+def _gte(value, bound):
+    try:
+        return value >= bound
+    except TypeError:
+        return False
+
+
+def _lt(value, bound):
+    try:
+        return value < bound
+    except TypeError:
+        return False
+
+
+def _lte(value, bound):
+    try:
+        return value <= bound
+    except TypeError:
+        return False
+
+
+_RANGE_OPERATORS = {_gt, _gte, _lt, _lte}
+
+_FILTER_OPERATORS = (
+    ('__eq', eq),
+    ('__ne', ne),
+    ('__type', isinstance),
+    ('__in', _in),
+    ('__nin', _not_in),
+    ('__gt', _gt),
+    ('__gte', _gte),
+    ('__lt', _lt),
+    ('__lte', _lte),
+)
+
+
+def _frozen(values):
+    """Converts collection of hashable values to frozenset for O(1) lookups"""
+    if not isinstance(values, (list, tuple, set)):
+        return values
+    try:
+        return frozenset(values)
+    except TypeError:
+        return values
+
+
+def _field_exists(obj, field):
+    if isinstance(obj, dict):
+        return field in obj
+    if hasattr(obj, field):
+        return True
+    try:
+        return field in obj
+    except Exception:
+        return False
+
+
+def _get_value(obj, field):
+    return obj[field] if isinstance(obj, dict) else getattr(obj, field)
+
+
+class _Missing(object):
+    """Value of a missing field. Pickled as a reference, so it stays a singleton in other processes."""
+
+    def __repr__(self):
+        return '<missing>'
+
+    def __reduce__(self):
+        return '_MISSING'
+
+
+_MISSING = _Missing()
+
+
+class _FieldGetter(object):
+    """Value of a top-level field of a dict or an object, _MISSING if there's no such field"""
+
+    def __init__(self, field):
+        self.field = field
+
+    def __call__(self, obj):
+        if isinstance(obj, dict):
+            return obj.get(self.field, _MISSING)
+        if _field_exists(obj, self.field):
+            return _get_value(obj, self.field)
+        return _MISSING
+
+
+class _PathGetter(object):
+    """
+    Value of a dotted path of nested dicts, lists and objects ('client.address.city'), default if there's none.
+    A dict key equal to the whole path is preferred. The rest is iterators.compile_hierarchy path (as in safe_get):
+    digits select list items by index, other path steps over a list return the first value found in its items.
+
+    >>> _PathGetter('a.b.0.c')({'a': {'b': [{'c': 1}, {'c': 2}]}})
+    1
+    >>> _PathGetter('a.b.c')({'a': {'b': [{'d': 1}, {'c': 2}]}})
+    2
+    >>> _PathGetter('a.b', default=None)({'a': {'c': 1}})
+    """
+
+    def __init__(self, path, default=_MISSING):
+        self.path = path
+        self.hierarchy = compile_hierarchy(path)
+        self.default = default
+
+    def __call__(self, obj):
+        if isinstance(obj, dict) and self.path in obj:
+            return obj[self.path]
+        return self.hierarchy.get(obj, self.default)
+
+    def __reduce__(self):
+        return _PathGetter, (self.path, self.default)
+
+
+def _field_getter(field):
+    """Getter of a field value from a dict or an object, _MISSING if the field is absent"""
+    if isinstance(field, str) and '.' in field:
+        return _PathGetter(field)
+    return _FieldGetter(field)
+
+
+def _dict_getter(field, default=_MISSING):
+    """Fastest getter of a field value from a dict, default if the field is absent"""
+    if isinstance(field, str) and '.' in field:
+        return _PathGetter(field, default)
+    return methodcaller('get', field, default)
+
+
+class IndexedListOfDicts(object):
+    """
+    List of dicts with hash indexes for find_dict_in_list-style queries.
+
+    Index is specified by field name or by comma-separated string (list) of fields for a composite key.
+    Queries with __eq or __in conditions on all fields of some index look up the index,
+    other queries scan rows as find_dict_in_list does. Results are in the order of rows.
+    Sorted indexes (add_sorted_index) serve __gt, __gte, __lt and __lte conditions with bisect.
+    Rows must not be changed in place while they are in the collection.
+
+    >>> rows = IndexedListOfDicts([{'id': 1, 'kind': 'a'}, {'id': 2, 'kind': 'b'}], 'id', 'kind,id')
+    >>> rows.append({'id': 3, 'kind': 'a'})
+    >>> list(rows.find(id=3))
+    [{'id': 3, 'kind': 'a'}]
+    >>> list(rows.find(id__in=[3, 1], kind='a'))
+    [{'id': 1, 'kind': 'a'}, {'id': 3, 'kind': 'a'}]
+    >>> list(rows.find(kind__ne='a'))
+    [{'id': 2, 'kind': 'b'}]
+    >>> rows.remove({'id': 1, 'kind': 'a'})
+    >>> list(rows.find(kind='a')), len(rows)
+    ([{'id': 3, 'kind': 'a'}], 2)
+    >>> next(rows.find(id=1, default=None))
+
+    >>> events = IndexedListOfDicts([{'date': 3}, {'date': 1}, {'date': None}, {'date': 2}, {}])
+    >>> events.add_sorted_index('date')
+    >>> list(events.find(date__gte=2))
+    [{'date': 3}, {'date': 2}]
+    >>> list(events.find(date__gt=1, date__lt=3))
+    [{'date': 2}]
+    """
+
+    def __init__(self, rows=(), *indexes):
+        # Rows by sequence number, in order of addition
+        self._rows = {}
+        self._seq = 0
+        # Index fields tuple -> _HashIndex
+        self.indexes = {}
+        # Field -> _SortedIndex
+        self.sorted_indexes = {}
+        for fields in indexes:
+            self.add_index(fields)
+        self.extend(rows)
+
+    def add_index(self, fields):
+        """
+        Adds hash index and fills it with existing rows
+        :param fields: field name, list or comma-separated string of fields for composite key
+        """
+        fields = tuple(_split_fields(fields))
+        if fields in self.indexes:
+            return
+        index = self.indexes[fields] = _HashIndex(fields)
+        for seq, row in self._rows.items():
+            index.add(seq, row)
+
+    def add_sorted_index(self, field):
+        """
+        Adds sorted index for range queries and fills it with existing rows
+        :param field: field name
+        """
+        if field in self.sorted_indexes:
+            return
+        index = self.sorted_indexes[field] = _SortedIndex(field)
+        index.add_many(self._rows.items())
+
+    def _all_indexes(self):
+        return chain(self.indexes.values(), self.sorted_indexes.values())
+
+    def append(self, row):
+        seq = self._seq
+        self._seq += 1
+        self._rows[seq] = row
+        for index in self._all_indexes():
+            index.add(seq, row)
+
+    def extend(self, rows):
+        """Appends rows. Sorted indexes sort new values once instead of inserting them one by one."""
+        start = self._seq
+        for row in rows:
+            seq = self._seq
+            self._seq += 1
+            self._rows[seq] = row
+            for index in self.indexes.values():
+                index.add(seq, row)
+        for index in self.sorted_indexes.values():
+            index.add_many((seq, self._rows[seq]) for seq in range(start, self._seq))
+
+    def remove(self, row):
+        """Removes the first row equal to the given one. Raises ValueError if there's no such row."""
+        candidates = self._rows
+        index = next(iter(self.indexes.values()), None)
+        if index is not None and isinstance(row, dict):
+            candidates = index.candidates([index.key(row)])
+        seq = next((seq for seq in candidates if self._rows[seq] == row), None)
+        if seq is None:
+            raise ValueError('IndexedListOfDicts.remove(x): x not in list')
+        for index in self._all_indexes():
+            index.discard(seq, self._rows[seq])
+        del self._rows[seq]
+
+    def find(self, values_dict=None, by_fields='', default='$nodefaultvalue$', **kwargs):
+        """
+        Iterator over matching rows, same as find_dict_in_list, but uses indexes when possible.
+        """
+        dict_filter = compile_filter(values_dict, by_fields, **kwargs)
+        if dict_filter.conditions is None:
+            return
+
+        any_matches = False
+        for row in dict_filter.filter(self._candidates(dict_filter)):
+            yield row
+            any_matches = True
+
+        if not any_matches and default != '$nodefaultvalue$':
+            yield default
+
+    def _candidates(self, dict_filter):
+        """Rows to check by the filter: from the most selective usable index, or all rows"""
+        # Field -> possible values, by the first __eq or __in condition of the field
+        lookups = {}
+        # Field -> range conditions
+        ranges = {}
+        for field, operator, value, getter in dict_filter.conditions:
+            if not field:
                 continue
-            # строгое существование, остальные поля можно не проверять
-            elif not exists:
-                break
+            if operator in _RANGE_OPERATORS:
+                ranges.setdefault(field, []).append((operator, value))
+            elif field in lookups:
+                continue
+            elif operator is eq and _is_hashable(value):
+                lookups[field] = (value,)
+            elif operator is _in and isinstance(value, frozenset):
+                lookups[field] = value
+
+        candidates = []
+        usable = [index for fields, index in self.indexes.items() if all(field in lookups for field in fields)]
+        if usable:
+            index = max(usable, key=lambda index: len(index.fields))
+            keys = product(*(lookups[field] for field in index.fields))
+            candidates.append(index.candidates(keys))
+        for field, conditions in ranges.items():
+            if field in self.sorted_indexes:
+                seqs = self.sorted_indexes[field].candidates(conditions)
+                if seqs is not None:
+                    candidates.append(seqs)
+        if not candidates:
+            return self._rows.values()
+        return (self._rows[seq] for seq in min(candidates, key=len))
+
+    def __iter__(self):
+        return iter(self._rows.values())
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __repr__(self):
+        return repr(list(self._rows.values()))
 
-            value = get_value(_dict, field)
-            # Сравниваем значения
-            if operator(value, target_value):
+
+class _HashIndex(object):
+    """Hash index of IndexedListOfDicts: key of fields values -> sequence numbers of rows"""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.getters = [_field_getter(field) for field in fields]
+        self.buckets = {}
+        # Rows that can't be indexed (unhashable values or not a dict), always are candidates
+        self.unindexed = {}
+
+    def key(self, row):
+        return tuple([getter(row) for getter in self.getters])
+
+    def add(self, seq, row):
+        try:
+            self.buckets.setdefault(self.key(row), {})[seq] = None
+        except TypeError:
+            self.unindexed[seq] = None
+
+    def discard(self, seq, row):
+        if seq in self.unindexed:
+            del self.unindexed[seq]
+            return
+        key = self.key(row)
+        bucket = self.buckets[key]
+        del bucket[seq]
+        if not bucket:
+            del self.buckets[key]
+
+    def candidates(self, keys):
+        """Sorted sequence numbers of rows with the given keys"""
+        seqs = set(self.unindexed)
+        for key in keys:
+            try:
+                seqs.update(self.buckets.get(key, ()))
+            except TypeError:
                 continue
-            # Иначе объект не подходит фильтру
-            break
-        else:
-            # совпадение - словарь
-            yield _dict
-            any_matches = True
+        return sorted(seqs)
 
-    # Если нет совпадений и задано значение по умолчанию
-    if not any_matches and default != '$nodefaultvalue$':
-        yield default
+
+# Batches smaller than 1/_SORTED_INDEX_BULK_RATIO of a sorted index are inserted one by one
+_SORTED_INDEX_BULK_RATIO = 256
+
+
+class _SortedIndex(object):
+    """
+    Sorted index of IndexedListOfDicts: field values with sequence numbers of rows, ordered by value.
+    Rows without the field or with None can't match range conditions and are not indexed.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.getter = _field_getter(field)
+        self.values = []
+        self.seqs = []
+        # Rows with values incomparable with the indexed ones, always are candidates
+        self.unsorted = {}
+
+    def add(self, seq, row):
+        value = self.getter(row)
+        if value is None or value is _MISSING:
+            return
+        self._insert(value, seq)
+
+    def add_many(self, seqs_rows):
+        """
+        Adds (sequence number, row) pairs with sequence numbers greater than indexed ones.
+        New values are sorted once and merged with indexed values (Timsort merges two sorted runs in linear time).
+        Small batches and values of incomparable types are inserted one by one.
+        """
+        pairs = []
+        for seq, row in seqs_rows:
+            value = self.getter(row)
+            if value is not None and value is not _MISSING:
+                pairs.append((value, seq))
+        if len(pairs) * _SORTED_INDEX_BULK_RATIO < len(self.values):
+            for value, seq in pairs:
+                self._insert(value, seq)
+            return
+        try:
+            merged = sorted(pairs, key=itemgetter(0))
+            if self.values:
+                merged = list(zip(self.values, self.seqs)) + merged
+                merged.sort(key=itemgetter(0))
+        except TypeError:
+            for value, seq in pairs:
+                self._insert(value, seq)
+            return
+        self.values = [value for value, _ in merged]
+        self.seqs = [seq for _, seq in merged]
+
+    def _insert(self, value, seq):
+        try:
+            position = bisect_right(self.values, value)
+        except TypeError:
+            self.unsorted[seq] = None
+            return
+        self.values.insert(position, value)
+        self.seqs.insert(position, seq)
+
+    def discard(self, seq, row):
+        if seq in self.unsorted:
+            del self.unsorted[seq]
+            return
+        value = self.getter(row)
+        if value is None or value is _MISSING:
+            return
+        position = bisect_left(self.values, value)
+        position = self.seqs.index(seq, position)
+        del self.values[position]
+        del self.seqs[position]
+
+    def candidates(self, conditions):
+        """
+        Sorted sequence numbers of rows that may match range conditions.
+        None if bounds are incomparable with indexed values.
+        """
+        low, high = 0, len(self.values)
+        try:
+            for operator, bound in conditions:
+                if operator is _gt:
+                    low = max(low, bisect_right(self.values, bound))
+                elif operator is _gte:
+                    low = max(low, bisect_left(self.values, bound))
+                elif operator is _lt:
+                    high = min(high, bisect_left(self.values, bound))
+                else:
+                    high = min(high, bisect_right(self.values, bound))
+        except TypeError:
+            return None
+        seqs = self.seqs[low:high] if low < high else []
+        if self.unsorted:
+            seqs.extend(self.unsorted)
+        return sorted(seqs)
+
+
+def _is_hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
 
 
 def sort_list_of_dicts(lst, keys, reverse=False, default=None, **convert):
     """
     Sort list of dicts by fields names. Allowed multiple fields names.
     :param lst: list of dicts
-    :param keys: fields names as sorting keys
+    :param keys: fields names as sorting keys, may be dotted paths to nested values
     :param reverse: reverse sorting flag
     :param default: default value for non existent fields. May be specified as dict {'field': 'default_value'} format
     :param convert: dict of conversion (before comparison) rules
     :return: sorted list of dicts
 
+    Key spec is resolved once, rows are sorted by stable passes from the last field to the first one.
+    So any comparable values (strings, dates) may be sorted in descending order.
+
     >>> lst = [{'order': 3, 'value': 3}, {'order': 1, 'value': 3}, {'order': 3, 'value': 1}]
     >>> sort_list_of_dicts(lst, 'order,value')
     [{'order': 1, 'value': 3}, {'order': 3, 'value': 1}, {'order': 3, 'value': 3}]
@@ -180,25 +754,528 @@ def sort_list_of_dicts(lst, keys, reverse=False, default=None, **convert):
     [{'k1': 'Asd'}, {'k1': 'JKd'}, {'k1': 'Ukz'}, {'k1': 'aqd'}, {'k1': 'lfe'}, {'k1': 'weg'}]
     >>> sort_list_of_dicts(lst, 'k1', k1=str.lower)
     [{'k1': 'aqd'}, {'k1': 'Asd'}, {'k1': 'JKd'}, {'k1': 'lfe'}, {'k1': 'Ukz'}, {'k1': 'weg'}]
+    >>> lst = [{'a': 'x', 'b': 1}, {'a': 'y', 'b': 1}, {'a': 'x', 'b': 2}]
+    >>> sort_list_of_dicts(lst, '-a,b')
+    [{'a': 'y', 'b': 1}, {'a': 'x', 'b': 1}, {'a': 'x', 'b': 2}]
+    >>> sort_list_of_dicts(lst, 'b,-a', reverse=True)
+    [{'a': 'x', 'b': 2}, {'a': 'x', 'b': 1}, {'a': 'y', 'b': 1}]
+    >>> sort_list_of_dicts([{'a': {'b': 2}}, {'a': {'b': 1}}, {}], '-a.b', default=0)
+    [{'a': {'b': 2}}, {'a': {'b': 1}}, {}]
+    """
+    rows = list(lst)
+    # Stable sorting passes from the last field to the first one
+    for field in reversed(_sort_fields(keys, default, convert)):
+        rows.sort(key=field.key, reverse=field.descending != reverse)
+    return rows
+
+
+def parallel_sort_list_of_dicts(lst, keys, reverse=False, default=None, workers=None, parallel_threshold=1000000,
+                                **convert):
+    """
+    sort_list_of_dicts in a process pool (sample sort).
+    Rows are split into key ranges by splitters sampled from the rows and the ranges are sorted
+    in a process pool, see _sample_sort. Sorting stays stable and the source rows themselves are returned.
+    Default values and conversion functions must be picklable (no lambdas).
+    :param lst: list of dicts
+    :param keys: fields names as sorting keys, as in sort_list_of_dicts
+    :param reverse: reverse sorting flag
+    :param default: default value for non existent fields. May be specified as dict {'field': 'default_value'} format
+    :param workers: Number of processes. CPU count by default
+    :param parallel_threshold: Minimal number of rows to start a process pool, less rows are sorted in place
+    :param convert: dict of conversion (before comparison) rules
+    :return: sorted list of dicts
+
+    >>> lst = [{'a': i % 4, 'b': str(i % 3)} for i in range(12)]
+    >>> parallel_sorted = parallel_sort_list_of_dicts(lst, '-b,a', workers=2, parallel_threshold=0, b=int)
+    >>> parallel_sorted == sort_list_of_dicts(lst, '-b,a', b=int)
+    True
+    """
+    rows = list(lst)
+    workers = workers or cpu_count() or 1
+    if _sort_fields(keys) and workers > 1 and len(rows) >= max(parallel_threshold, 2):
+        return _sample_sort(rows, (keys, reverse, default, convert), workers)
+    return sort_list_of_dicts(rows, keys, reverse, default, **convert)
+
+
+def top_k_list_of_dicts(lst, keys, k, reverse=False, default=None, offset=0, **convert):
+    """
+    First k rows of sort_list_of_dicts result, selected with a heap: O(n log k) instead of full sort.
+    :param lst: list (or iterable) of dicts
+    :param keys: fields names as sorting keys, as in sort_list_of_dicts
+    :param k: number of rows to return
+    :param reverse: reverse sorting flag
+    :param default: default value for non existent fields. May be specified as dict {'field': 'default_value'} format
+    :param offset: number of first rows to skip
+    :param convert: dict of conversion (before comparison) rules
+    :return: list of dicts, equal to sort_list_of_dicts(lst, keys, ...)[offset:offset + k]
+
+    >>> lst = [{'a': 'x', 'b': 1}, {'a': 'y', 'b': 1}, {'a': 'x', 'b': 2}]
+    >>> top_k_list_of_dicts(lst, '-a,b', 2)
+    [{'a': 'y', 'b': 1}, {'a': 'x', 'b': 1}]
+    >>> top_k_list_of_dicts(lst, 'b', 1, offset=1)
+    [{'a': 'y', 'b': 1}]
+    >>> top_k_list_of_dicts(lst, 'b', 5, reverse=True, offset=2)
+    [{'a': 'y', 'b': 1}]
     """
-    keys = keys.split(',') if isinstance(keys, str) else keys
-    keys_list = []
-    for key in keys:
-        field, direction = (key[1:], -1) if isinstance(key, str) and key.startswith('-') else (key, 1)
-        keys_list.append(dict(direction=direction, field=field))
+    return _top_list_of_dicts(lst, _sort_fields(keys, default, convert), reverse, offset + k)[offset:]
 
-    def key(x):
-        result = []
-        for k in keys_list:
-            field = k['field']
-            k_default = default.get(field) if isinstance(default, dict) else default
-            value = x.get(field, k_default)
-            if field in convert:
-                value = convert[field](value)
-            result.append(k['direction'] * value)
-        return result
 
-    return sorted(lst, key=key, reverse=reverse)
+def compile_sort_key(keys, reverse=False, default=None, convert=None):
+    """
+    Single key function of sort_list_of_dicts order, for sorted(), bisect, heaps and sorted containers.
+    :param keys: fields names as sorting keys, as in sort_list_of_dicts
+    :param reverse: reverse sorting flag
+    :param default: default value for non existent fields. May be specified as dict {'field': 'default_value'} format
+    :param convert: dict of conversion (before comparison) rules by fields
+    :return: key function of a dict
+
+    >>> lst = [{'a': 'x', 'b': 2}, {'a': 'y', 'b': 1}, {'a': 'x', 'b': 1}]
+    >>> sorted(lst, key=compile_sort_key('-a,b')) == sort_list_of_dicts(lst, '-a,b')
+    True
+    >>> [row['b'] for row in sorted(lst, key=compile_sort_key('-b', convert={'b': str}))]
+    [2, 1, 1]
+    """
+    key, descending = _row_key(_sort_fields(keys, default, convert), reverse)
+    return partial(_descending_key, key) if descending else key
+
+
+def _descending_key(key, row):
+    return _Descending(key(row))
+
+
+# Key ranges per worker of parallel sort (more ranges than workers even out uneven ranges)
+_SAMPLE_SORT_RANGES_PER_WORKER = 4
+# Sampled rows per key range
+_SAMPLE_SORT_OVERSAMPLING = 64
+
+
+def _sample_sort(rows, sort_spec, workers):
+    """
+    Stable sorting of rows in a process pool (sample sort).
+
+    Values of the first sort field of a random sample of rows give splitters of key ranges.
+    Workers find key ranges of slices of rows, rows of every range are sorted by a worker by all fields,
+    and the sorted ranges are concatenated.
+    Rows with equal first field values fall into the same range in the source order, so sorting stays stable.
+
+    Rows are passed to workers once, by pool initializer (inherited without pickling where processes are forked).
+    Tasks and results are positions of rows only, the result consists of the source rows.
+
+    :param rows: list of dicts
+    :param sort_spec: (keys, reverse, default, convert) params of sort_list_of_dicts, rebuilt by workers
+    :param workers: Number of processes
+    """
+    keys, reverse, default, convert = sort_spec
+    first = _sort_fields(keys, default, convert)[0]
+    ranges_count = workers * _SAMPLE_SORT_RANGES_PER_WORKER
+    # Own generator: sampling does not change state of the global one
+    sample = random.Random().sample(rows, min(len(rows), ranges_count * _SAMPLE_SORT_OVERSAMPLING))
+    sample = sorted(map(first.key, sample))
+    candidates = [sample[len(sample) * i // ranges_count] for i in range(1, ranges_count)]
+    splitters = [key for i, key in enumerate(candidates) if not i or candidates[i - 1] < key]
+    pool_map = partial(parallel_map, workers=workers, mode='process',
+                       initializer=_set_worker_rows, initargs=(rows,))
+
+    chunk_size = -(-len(rows) // ranges_count)
+    slices = ((start, start + chunk_size) for start in range(0, len(rows), chunk_size))
+    ranges = [[] for _ in range(len(splitters) + 1)]
+    for slice_ranges in pool_map(partial(_find_key_ranges, sort_spec, splitters), slices):
+        for positions, slice_positions in zip(ranges, slice_ranges):
+            positions.extend(slice_positions)
+    if first.descending != reverse:
+        ranges.reverse()
+
+    result = []
+    for positions in pool_map(partial(_sort_positions, sort_spec), filter(None, ranges)):
+        result.extend(map(rows.__getitem__, positions))
+    return result
+
+
+# Rows of sample sort in a worker process, set by pool initializer
+_worker_rows = None
+
+
+def _set_worker_rows(rows):
+    global _worker_rows
+    _worker_rows = rows
+
+
+def _find_key_ranges(sort_spec, splitters, rows_slice):
+    """Positions of rows of (start, stop) slice grouped by ranges of the first sort field values between splitters"""
+    keys, reverse, default, convert = sort_spec
+    first = _sort_fields(keys, default, convert)[0]
+    start, stop = rows_slice
+    numbers = list(map(partial(bisect_right, splitters), map(first.key, islice(_worker_rows, start, stop))))
+    order = sorted(range(len(numbers)), key=numbers.__getitem__)
+    sorted_numbers = list(map(numbers.__getitem__, order))
+    bounds = [bisect_left(sorted_numbers, number) for number in range(len(splitters) + 2)]
+    return [list(map(start.__add__, order[begin:end])) for begin, end in zip(bounds, bounds[1:])]
+
+
+def _sort_positions(sort_spec, positions):
+    """Positions sorted by rows at them, by all sort fields"""
+    keys, reverse, default, convert = sort_spec
+    rows = list(map(_worker_rows.__getitem__, positions))
+    order = list(range(len(rows)))
+    for field in reversed(_sort_fields(keys, default, convert)):
+        field_keys = list(map(field.key, rows))
+        order.sort(key=field_keys.__getitem__, reverse=field.descending != reverse)
+    return list(map(positions.__getitem__, order))
+
+
+class _SortField(object):
+    """Sort key of a single field: field value with default and conversion applied"""
+
+    def __init__(self, field, descending=False, default=None, convert=None):
+        self.field = field
+        self.descending = descending
+        self.default = default
+        self.convert = convert
+        self.getter = _dict_getter(field, default)
+
+    @property
+    def key(self):
+        """Fastest equivalent key function"""
+        if self.convert is None:
+            return self.getter
+        return self
+
+    def __call__(self, row):
+        value = self.getter(row)
+        if self.convert is None:
+            return value
+        return self.convert(value)
+
+
+def external_sort_list_of_dicts(iterable, keys, reverse=False, default=None, buffer_rows=100000, tmp_dir=None,
+                                **convert):
+    """
+    Sorts rows that don't fit in memory. Same keys spec as in sort_list_of_dicts.
+
+    Rows are read by buffer_rows, each buffer is sorted and written to a temporary file (pickled blocks of rows).
+    Sorted runs are merged lazily. Sorting is stable.
+
+    >>> rows = ({'a': i % 3, 'b': i} for i in range(7))
+    >>> [(row['a'], row['b']) for row in external_sort_list_of_dicts(rows, '-a,b', buffer_rows=2)]
+    [(2, 2), (2, 5), (1, 1), (1, 4), (0, 0), (0, 3), (0, 6)]
+
+    :param iterable: iterable of dicts, e.g. sv_import generator
+    :param keys: fields names as sorting keys, see sort_list_of_dicts
+    :param reverse: reverse sorting flag
+    :param default: default value for non existent fields, see sort_list_of_dicts
+    :param buffer_rows: memory budget, maximum number of rows to sort in memory at once
+    :param tmp_dir: directory for temporary files
+    :param convert: dict of conversion (before comparison) rules
+    :return: generator of sorted dicts
+    """
+    iterator = iter(iterable)
+    runs = []
+    try:
+        while True:
+            buffer = sort_list_of_dicts(islice(iterator, buffer_rows), keys, reverse, default, **convert)
+            if not buffer:
+                break
+            # All rows fit in memory
+            if not runs and len(buffer) < buffer_rows:
+                yield from buffer
+                return
+            runs.append(_write_run(buffer, tmp_dir))
+            del buffer
+
+        row_key, descending = _row_key(_sort_fields(keys, default, convert), reverse)
+        yield from merge(*map(_read_run, runs), key=row_key, reverse=descending)
+    finally:
+        for run in runs:
+            run.close()
+
+
+# Number of rows pickled together in sorted runs of external sort
+_RUN_BLOCK_SIZE = 1000
+
+
+def _write_run(rows, tmp_dir=None):
+    run = TemporaryFile(dir=tmp_dir)
+    for i in range(0, len(rows), _RUN_BLOCK_SIZE):
+        pickle.dump(rows[i:i + _RUN_BLOCK_SIZE], run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    while True:
+        try:
+            block = pickle.load(run)
+        except EOFError:
+            return
+        yield from block
+
+
+def _top_list_of_dicts(lst, sort_fields, reverse, count):
+    """
+    First count rows of sorted list of dicts, selected with a heap of count rows by the composite row key:
+    O(n log k) time and O(k) memory for any iterable. Equal rows keep the source order, as in the full sort.
+    The heap keeps the worst selected row on top. Rows are compared with it by the first field value first,
+    so the composite key is built only for rows that may get into the heap.
+    """
+    if count <= 0:
+        return []
+    if not sort_fields:
+        return list(islice(lst, count))
+    row_key, descending = _row_key(sort_fields, reverse)
+    if len(sort_fields) == 1:
+        return (nlargest if descending else nsmallest)(count, lst, key=row_key)
+
+    first = sort_fields[0]
+    first_key, first_descending = first.key, first.descending != reverse
+    # Entries: (_Descending((ascending row key, source position)), first field value, row)
+    heap = []
+    for position, row in enumerate(lst):
+        value = first_key(row)
+        if len(heap) == count:
+            worst_value = heap[0][1]
+            if (value < worst_value) if first_descending else (worst_value < value):
+                continue
+        key = row_key(row)
+        entry_key = (_Descending(key) if descending else key, position)
+        if len(heap) < count:
+            heappush(heap, (_Descending(entry_key), value, row))
+        elif entry_key < heap[0][0].value:
+            heapreplace(heap, (_Descending(entry_key), value, row))
+    return [row for _, _, row in sorted(heap, reverse=True)]
+
+
+def _row_key(sort_fields, reverse=False):
+    """
+    Key of a row by all sort fields, for a single comparison (heap, merge, bisect).
+    Fields descending against the common direction are wrapped to _Descending.
+    :return: key function, common direction flag (descending)
+    """
+    directions = {field.descending != reverse for field in sort_fields}
+    descending = directions == {True}
+    if len(sort_fields) == 1:
+        return sort_fields[0].key, descending
+    return _RowKey([(field.key, len(directions) > 1 and field.descending != reverse)
+                    for field in sort_fields]), descending
+
+
+class _RowKey(object):
+    """Tuple key of a row: (key function, wrap to _Descending flag) for each field"""
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def __call__(self, row):
+        return tuple([_Descending(key(row)) if descending else key(row) for key, descending in self.keys])
+
+
+class _Descending(object):
+    """Value wrapper with reversed ordering"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __gt__(self, other):
+        return other.value > self.value
+
+    def __le__(self, other):
+        return other.value <= self.value
+
+    def __ge__(self, other):
+        return other.value >= self.value
+
+    def __repr__(self):
+        return f'_Descending({self.value!r})'
+
+
+def _sort_fields(keys, default=None, convert=None):
+    """
+    Resolves sort_list_of_dicts keys spec once: list of _SortField
+    :param keys: fields names, comma-separated string or list. '-' prefix means descending order.
+    :param default: default value for non existent fields, or dict of defaults by fields
+    :param convert: dict of conversion functions by fields
+    """
+    convert = convert or {}
+    sort_fields = []
+    for key in _split_fields(keys):
+        field, descending = (key[1:], True) if isinstance(key, str) and key.startswith('-') else (key, False)
+        field_default = default.get(field) if isinstance(default, dict) else default
+        sort_fields.append(_SortField(field, descending, field_default, convert.get(field)))
+    return sort_fields
+
+
+def join_list_of_dicts(left, right, local_field='_id', foreign_field='_id', as_field='', how='inner', unwind=True):
+    """
+    In-memory hash join of lists of dicts, mirrors $lookup (and $unwind) output shapes.
+    Hash table is built on the smaller side, the larger one is streamed. O(n + m).
+
+    >>> orders = [{'id': 1, 'client': 'a'}, {'id': 2, 'client': 'b'}, {'id': 3, 'client': 'a'}]
+    >>> clients = [{'_id': 'a', 'name': 'Ann'}, {'_id': 'c', 'name': 'Cid'}]
+    >>> list(join_list_of_dicts(orders, clients, 'client', as_field='client'))
+    [{'id': 1, 'client': {'_id': 'a', 'name': 'Ann'}}, {'id': 3, 'client': {'_id': 'a', 'name': 'Ann'}}]
+    >>> list(join_list_of_dicts(orders[:2], clients, 'client', as_field='client_info', how='left'))
+    [{'id': 1, 'client': 'a', 'client_info': {'_id': 'a', 'name': 'Ann'}}, {'id': 2, 'client': 'b'}]
+    >>> list(join_list_of_dicts(clients, orders, '_id', 'client', 'orders', how='left', unwind=False))
+    [{'_id': 'a', 'name': 'Ann', 'orders': [{'id': 1, 'client': 'a'}, {'id': 3, 'client': 'a'}]}, {'_id': 'c', 'name': 'Cid', 'orders': []}]
+    >>> list(join_list_of_dicts([{'ids': ['c', 'a', 'c']}, {'ids': []}], clients, 'ids', as_field='cl', how='left', unwind=False))
+    [{'ids': ['c', 'a', 'c'], 'cl': [{'_id': 'c', 'name': 'Cid'}, {'_id': 'a', 'name': 'Ann'}]}, {'ids': [], 'cl': []}]
+
+    :param left: list (or iterable) of dicts, input documents of $lookup
+    :param right: list (or iterable) of dicts, "from" collection of $lookup
+    :param local_field: field of left dicts, may be a dotted path. Missing value is equal to None.
+        Array value matches every its element (as $lookup does).
+    :param foreign_field: field of right dicts, may be a dotted path. Missing value is equal to None.
+    :param as_field: field to write matches to. local_field by default.
+    :param how: 'inner' - skip left dicts without matches, 'left' - keep them (preserveNullAndEmptyArrays)
+    :param unwind: True - a dict per match (as $unwind), False - list of matches in as_field (as $lookup)
+    :return: generator of joined dicts (shallow copies of left dicts) in order of left and right rows
+    """
+    if how not in ('inner', 'left'):
+        raise ValueError(f"Unknown join type '{how}', 'inner' or 'left' expected")
+    if not as_field:
+        as_field = local_field
+    local_getter, foreign_getter = _dict_getter(local_field, None), _dict_getter(foreign_field, None)
+
+    if _is_smaller(left, right):
+        # Hash table of left keys, right rows are streamed and only matches are kept
+        left = left if isinstance(left, (list, tuple)) else list(left)
+        matches = {}
+        for row in left:
+            for key in _join_keys(local_getter(row)):
+                matches[key] = []
+        for row in right:
+            try:
+                row_matches = matches.get(foreign_getter(row))
+            except TypeError:
+                continue
+            if row_matches is not None:
+                row_matches.append(row)
+    else:
+        # Hash table of right rows, left rows are streamed
+        matches = {}
+        for row in right:
+            try:
+                matches.setdefault(foreign_getter(row), []).append(row)
+            except TypeError:
+                continue
+
+    for row in left:
+        row_matches = _join_matches(matches, local_getter(row))
+        if not row_matches and how == 'inner':
+            continue
+        if not unwind:
+            yield {**row, as_field: list(row_matches)}
+        elif not row_matches:
+            # $unwind with preserveNullAndEmptyArrays removes the field of empty array
+            yield {field: value for field, value in row.items() if field != as_field}
+        else:
+            for match in row_matches:
+                yield {**row, as_field: match}
+
+
+def _join_keys(value):
+    """Hashable keys to look up for a local value: every element of a list"""
+    values = value if isinstance(value, list) else (value,)
+    return [key for key in values if _is_hashable(key)]
+
+
+def _join_matches(matches, value):
+    """Matched right rows of a local value, rows matched by several list elements are taken once"""
+    if not isinstance(value, list):
+        try:
+            return matches.get(value, ())
+        except TypeError:
+            return ()
+    row_matches, seen = [], set()
+    for key in _join_keys(value):
+        for row in matches.get(key, ()):
+            if id(row) not in seen:
+                seen.add(id(row))
+                row_matches.append(row)
+    return row_matches
+
+
+def _is_smaller(one, other):
+    """Checks if one collection is known to be smaller than the other one"""
+    try:
+        return len(one) < len(other)
+    except TypeError:
+        return False
+
+
+def distinct_list_of_dicts(rows, fields=None, keep='first'):
+    """
+    Iterates over rows without duplicates, in one pass over any iterable.
+    Rows are compared by structural keys of nested values (see structural_key), rows aren't copied.
+
+    >>> rows = [{'a': [1, {'b': 2}], 'c': 1}, {'c': 1, 'a': [1, {'b': 2}]}, {'a': [1], 'c': 2}, {'a': [1], 'c': 3}]
+    >>> list(distinct_list_of_dicts(rows))
+    [{'a': [1, {'b': 2}], 'c': 1}, {'a': [1], 'c': 2}, {'a': [1], 'c': 3}]
+    >>> list(distinct_list_of_dicts(iter(rows), 'a'))
+    [{'a': [1, {'b': 2}], 'c': 1}, {'a': [1], 'c': 2}]
+    >>> list(distinct_list_of_dicts(rows, ['a'], keep='last'))
+    [{'c': 1, 'a': [1, {'b': 2}]}, {'a': [1], 'c': 3}]
+    >>> list(distinct_list_of_dicts([{'a': None}, {}, {'a': None}], 'a'))
+    [{'a': None}, {}]
+
+    :param rows: Iterable of dicts
+    :param fields: Fields to compare rows by, list or comma-separated string. Whole rows by default.
+    Missing field differs from None.
+    :param keep: 'first' - yields the first row of duplicates as soon as it is met,
+    'last' - yields the last row of duplicates after the source is consumed, in order of last occurrences
+    """
+    if keep not in ('first', 'last'):
+        raise ValueError(f"keep must be 'first' or 'last', not {keep!r}")
+    fields = _split_fields(fields)
+    if fields:
+        getters = [_dict_getter(field) for field in fields]
+        row_key = lambda row: tuple(structural_key(getter(row)) for getter in getters)
+    else:
+        row_key = structural_key
+
+    if keep == 'first':
+        seen = set()
+        for row in rows:
+            key = row_key(row)
+            if key not in seen:
+                seen.add(key)
+                yield row
+        return
+
+    # Reinsertion moves key to the end, so dict keeps order of last occurrences
+    last_rows = {}
+    for row in rows:
+        key = row_key(row)
+        last_rows.pop(key, None)
+        last_rows[key] = row
+    yield from last_rows.values()
+
+
+def structural_key(value):
+    """
+    Hashable key of a value, equal for equal values: dicts regardless of keys order,
+    lists and tuples by items, sets as frozensets. Hashable values are keys of themselves.
+
+    >>> structural_key({'a': [1, {2}], 'b': 1}) == structural_key({'b': 1, 'a': [1, {2}]})
+    True
+    >>> structural_key([1]) == structural_key((1,))
+    False
+    """
+    if isinstance(value, dict):
+        return dict, frozenset((key, structural_key(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(map(structural_key, value))
+    if isinstance(value, (set, frozenset)):
+        return frozenset, frozenset(map(structural_key, value))
+    if _is_hashable(value):
+        return value
+    return type(value), repr(value)
 
 
 def column_sum(data, column_name):
@@ -211,7 +1288,10 @@ def column_sum(data, column_name):
     return sum(row[column_name] if column_name in row else 0 for row in data)
 
 
-def group_list_of_dicts(_source_list, by_fields='', sum_fields='', append_to_list='', add_to_set=''):
+def group_list_of_dicts(_source_list, by_fields='', sum_fields='', append_to_list='', add_to_set='',
+                        min_fields='', max_fields='', avg_fields='', counter_fields='', first_fields='',
+                        last_fields='', parallel=False, workers=None, chunk_size=10000,
+                        parallel_threshold=PARALLEL_THRESHOLD):
     """
     Группирует список словарей по полям выборки
 
@@ -237,8 +1317,28 @@ def group_list_of_dicts(_source_list, by_fields='', sum_fields='', append_to_lis
     [{'a': 1, 'b': [2, 3, 2], 'c': [5, 5, 6]}, {'a': 1, 'd': 1, 'b': [2], 'c': [5]}]
     >>> group_list_of_dicts(source_list, 'a,d', add_to_set='b,c')
     [{'a': 1, 'b': {2, 3}, 'c': {5, 6}}, {'a': 1, 'd': 1, 'b': {2}, 'c': {5}}]
+    >>> group_list_of_dicts(iter(source_list), 'a,d', 'c', append_to_list='b')
+    [{'a': 1, 'c': 16, 'b': [2, 3, 2]}, {'a': 1, 'd': 1, 'c': 5, 'b': [2]}]
+    >>> group_list_of_dicts([{'a': [1], 'b': 1}, {'a': [2], 'b': 2}, {'a': [1], 'b': 3}], 'a', 'b')
+    [{'a': [1], 'b': 4}, {'a': [2], 'b': 2}]
+    >>> group_list_of_dicts([{'c': {'city': 'A'}, 'n': 1}, {'c': {'city': 'A'}, 'n': 2}, {'n': 3}], 'c.city', 'n')
+    [{'c.city': 'A', 'n': 3}, {'n': 3}]
+
+    >>> group_list_of_dicts(source_list, 'a,d', 'c', add_to_set='b', chunk_size=2, parallel=True, workers=2,
+    ...                     parallel_threshold=0)
+    [{'a': 1, 'c': 16, 'b': {2, 3}}, {'a': 1, 'd': 1, 'c': 5, 'b': {2}}]
+    >>> group_list_of_dicts(source_list, 'a,d', min_fields='b', max_fields='c', avg_fields='e', counter_fields='n')
+    [{'a': 1, 'b': 2, 'c': 6, 'e': None, 'n': 3}, {'a': 1, 'd': 1, 'b': 2, 'c': 5, 'e': None, 'n': 1}]
+    >>> group_list_of_dicts(source_list, 'a', avg_fields='b', first_fields='c', last_fields='d')
+    [{'a': 1, 'b': 2.25, 'c': 5, 'd': 1}]
+    >>> group_list_of_dicts(source_list, 'a', first_fields='d')
+    [{'a': 1, 'd': None}]
 
-    :param _source_list: Исходный список словарей
+    Группировка выполняется за один проход, без копирования исходного списка.
+    В режиме parallel источник делится на части по chunk_size строк, части группируются
+    в пуле процессов, а частичные состояния (GroupingState) объединяются в исходном порядке.
+
+    :param _source_list: Исходный список словарей (либо любой итерируемый объект словарей)
     :param by_fields: Поля выборки
     :type by_fields: Список, либо строка ключей через запятые
     :param sum_fields: Поля, которые суммируются при группировке
@@ -247,58 +1347,296 @@ def group_list_of_dicts(_source_list, by_fields='', sum_fields='', append_to_lis
     :type append_to_list: Список, либо строка ключей через запятые
     :param add_to_set: Поля, которые добавляются в множество (set) при группировке
     :type add_to_set: Список, либо строка ключей через запятые
+    :param min_fields: Поля, по которым берется минимальное значение ($min)
+    :param max_fields: Поля, по которым берется максимальное значение ($max)
+    :param avg_fields: Поля, по которым берется среднее значение ($avg)
+    :param counter_fields: Поля, в которые записывается количество строк группы ($sum: 1)
+    :param first_fields: Поля, значение которых берется из первой строки группы ($first)
+    :param last_fields: Поля, значение которых берется из последней строки группы ($last)
+    Все поля задаются списком, либо строкой ключей через запятые.
+    Отсутствующие поля и None не учитываются в $min, $max и $avg, а в $first и $last дают None.
+    :param parallel: Флаг, группировать части источника в пуле процессов
+    :param workers: Количество процессов пула. По умолчанию - количество процессоров
+    :param chunk_size: Размер части источника для параллельной группировки
+    :param parallel_threshold: Минимальное количество строк источника для запуска пула процессов,
+    меньшие источники группируются в текущем процессе
     :return: Список словарей
     """
-    if isinstance(by_fields, str):
-        by_fields = by_fields.split(',')
-        if '' in by_fields: by_fields.remove('')
-    if not by_fields: return _source_list
-    if isinstance(sum_fields, str):
-        sum_fields = sum_fields.split(',')
-        if '' in sum_fields: sum_fields.remove('')
-
-    if isinstance(append_to_list, str):
-        append_to_list = append_to_list.split(',')
-        if '' in append_to_list: append_to_list.remove('')
-
-    if isinstance(add_to_set, str):
-        add_to_set = add_to_set.split(',')
-        if '' in add_to_set: add_to_set.remove('')
-
-    # Собираем словари в группы по полям выборки
-    # В итоге получим список списков схоих по полям выборки словарей
-    source_list = deepcopy(_source_list)
-    assistive_list = []
-    while source_list:
-        base_dict = source_list[0]
-        matches = [
-            match_dict for match_dict in source_list
-            if all([match_dict.get(key, None) == base_dict.get(key, None) for key in by_fields])
+    state = GroupingState(by_fields, sum_fields, append_to_list, add_to_set, min_fields, max_fields,
+                          avg_fields, counter_fields, first_fields, last_fields)
+    if not state.by_fields: return _source_list
+
+    if not parallel:
+        return state.update(_source_list).result()
+
+    # Tasks carry an empty template of the state: the merged state grows and is changed by this thread only
+    group_chunk = partial(_group_chunk, state.empty_copy())
+    for _, chunk_state in _imap_chunks(group_chunk, _source_list, chunk_size, workers, parallel_threshold):
+        state.merge(chunk_state)
+    return state.result()
+
+
+class GroupingState(object):
+    """
+    Partial state of list of dicts grouping (group_list_of_dicts semantics).
+    Fields may be dotted paths to nested values ('client.address.city').
+
+    States are picklable, so they may be built for chunks of a source in different processes
+    and merged afterwards. Merge order must follow the order of chunks to keep groups order.
+
+    >>> state = GroupingState('a', sum_fields='b', append_to_list='c')
+    >>> other = GroupingState('a', sum_fields='b', append_to_list='c').update([{'a': 2, 'b': 1}, {'a': 1, 'c': 3}])
+    >>> state.update([{'a': 1, 'b': 1, 'c': 1}]).merge(other).result()
+    [{'a': 1, 'b': 1, 'c': [1, 3]}, {'a': 2, 'b': 1, 'c': []}]
+    >>> from pickle import dumps, loads
+    >>> loads(dumps(state)).result() == state.result()
+    True
+    """
+
+    def __init__(self, by_fields='', sum_fields='', append_to_list='', add_to_set='', min_fields='',
+                 max_fields='', avg_fields='', counter_fields='', first_fields='', last_fields=''):
+        self.by_fields = _split_fields(by_fields)
+        # Accumulators: field -> accumulator name. If fields lists intersect the last one wins.
+        self.accumulators = {}
+        accumulators_fields = (
+            (sum_fields, 'sum'), (append_to_list, 'list'), (add_to_set, 'set'), (min_fields, 'min'),
+            (max_fields, 'max'), (avg_fields, 'avg'), (counter_fields, 'count'), (first_fields, 'first'),
+            (last_fields, 'last'),
+        )
+        for fields, accumulator in accumulators_fields:
+            for field in _split_fields(fields):
+                self.accumulators[field] = accumulator
+        # Groups in order of the first appearance: (key, row with accumulators states)
+        self.groups = []
+        self._index = {}
+        self._unhashable_groups = []
+
+    def empty_copy(self):
+        """Returns a new empty state with the same grouping settings"""
+        state = copy(self)
+        state.groups, state._index, state._unhashable_groups = [], {}, []
+        return state
+
+    def _find(self, key):
+        try:
+            return self._index.get(key)
+        except TypeError:
+            # Unhashable values of by_fields are compared one by one
+            return next((row for group_key, row in self._unhashable_groups if group_key == key), None)
+
+    def _add_group(self, key, row):
+        try:
+            self._index[key] = row
+        except TypeError:
+            self._unhashable_groups.append((key, row))
+        self.groups.append((key, row))
+
+    def update(self, rows):
+        """
+        Adds rows to the state
+        :param rows: iterable of dicts
+        :return: self
+        """
+        by_fields = self.by_fields
+        by_getters = [_dict_getter(field) for field in by_fields]
+        accumulators = [
+            (field, _dict_getter(field), _ACCUMULATORS[accumulator][1], accumulator in _ACCUMULATORS_OF_MISSING)
+            for field, accumulator in self.accumulators.items()
         ]
-        assistive_list.append(matches)
-        for match_dict in matches:
-            if not match_dict in source_list: continue
-            source_list.remove(match_dict)
+        for row in rows:
+            values = [getter(row) for getter in by_getters]
+            key = tuple([None if value is _MISSING else value for value in values])
+            cur_row = self._find(key)
+            if cur_row is None:
+                # By fields of the first row of group are the base of resulting dict
+                cur_row = {field: value for field, value in zip(by_fields, values) if value is not _MISSING}
+                for field, accumulator in self.accumulators.items():
+                    cur_row[field] = _ACCUMULATORS[accumulator][0]()
+                self._add_group(key, cur_row)
 
-    # Формируем итоговый список словарей
-    result = []
-    for group_list in assistive_list:
-        # Берем все поля выборки как основу словаря
-        cur_row = {
-            field: group_list[0][field] for field in by_fields
-            if field in group_list[0]
+            for field, getter, accumulate, of_missing in accumulators:
+                value = getter(row)
+                if value is not _MISSING:
+                    cur_row[field] = accumulate(cur_row[field], value)
+                elif of_missing:
+                    cur_row[field] = accumulate(cur_row[field], None)
+        return self
+
+    def merge(self, other):
+        """
+        Merges the state of following rows into this one
+        :param other: GroupingState with the same settings
+        :return: self
+        """
+        for key, other_row in other.groups:
+            cur_row = self._find(key)
+            if cur_row is None:
+                self._add_group(key, other_row)
+                continue
+            for field, accumulator in self.accumulators.items():
+                cur_row[field] = _ACCUMULATORS[accumulator][2](cur_row[field], other_row[field])
+        return self
+
+    def result(self):
+        """Returns list of grouped dicts"""
+        results = {
+            field: _ACCUMULATORS[accumulator][3]
+            for field, accumulator in self.accumulators.items()
+            if _ACCUMULATORS[accumulator][3]
         }
-        # Суммируем поля, указанные в sum_fields
-        for field in sum_fields:
-            cur_row[field] = column_sum(group_list, field)
-        # Добавляем в список поля, указанные в append_to_list
-        for field in append_to_list:
-            cur_row[field] = [row[field] for row in group_list if field in row]
-        # Добавляем во множество поля, указанные в add_to_set
-        for field in add_to_set:
-            cur_row[field] = {row[field] for row in group_list if field in row}
-        result.append(cur_row)
-    return result
+        if not results:
+            return [row for key, row in self.groups]
+        return [
+            {**row, **{field: result(row[field]) for field, result in results.items()}}
+            for key, row in self.groups
+        ]
+
+
+def _append(accumulated, value):
+    accumulated.append(value)
+    return accumulated
+
+
+def _extend(accumulated, values):
+    accumulated.extend(values)
+    return accumulated
+
+
+def _add_to_set(accumulated, value):
+    accumulated.add(value)
+    return accumulated
+
+
+def _update_set(accumulated, values):
+    accumulated.update(values)
+    return accumulated
+
+
+def _min(accumulated, value):
+    if value is None:
+        return accumulated
+    return value if accumulated is None or value < accumulated else accumulated
+
+
+def _max(accumulated, value):
+    if value is None:
+        return accumulated
+    return value if accumulated is None or value > accumulated else accumulated
+
+
+def _avg_add(accumulated, value):
+    if value is not None:
+        accumulated[0] += value
+        accumulated[1] += 1
+    return accumulated
+
+
+def _avg_merge(accumulated, other):
+    accumulated[0] += other[0]
+    accumulated[1] += other[1]
+    return accumulated
+
+
+def _avg_result(accumulated):
+    total, count = accumulated
+    return total / count if count else None
+
+
+def _avg_initial():
+    return [0, 0]
+
+
+def _count(accumulated, value):
+    return accumulated + 1
+
+
+def _first(accumulated, value):
+    if not accumulated:
+        accumulated.append(value)
+    return accumulated
+
+
+def _first_merge(accumulated, other):
+    return accumulated or other
+
+
+def _first_result(accumulated):
+    return accumulated[0] if accumulated else None
+
+
+def _last(accumulated, value):
+    return value
+
+
+def _none():
+    return None
+
+
+# Accumulator name -> (initial state factory, add value, merge states, state to result or None)
+_ACCUMULATORS = {
+    'sum': (int, add, add, None),
+    'list': (list, _append, _extend, None),
+    'set': (set, _add_to_set, _update_set, None),
+    'min': (_none, _min, _min, None),
+    'max': (_none, _max, _max, None),
+    'avg': (_avg_initial, _avg_add, _avg_merge, _avg_result),
+    'count': (int, _count, add, None),
+    'first': (list, _first, _first_merge, _first_result),
+    'last': (_none, _last, _last, None),
+}
+# Accumulators that take rows without the field into account (value is None)
+_ACCUMULATORS_OF_MISSING = {'count', 'first', 'last'}
+
+
+def _group_chunk(state, chunk):
+    return state.empty_copy().update(chunk)
+
+
+def _filter_chunk(dict_filter, chunk):
+    """Positions of matching rows, so that only integers are sent back from a worker"""
+    return list(compress(range(len(chunk)), map(dict_filter.match, chunk)))
+
+
+def _map_chunk(func, chunk):
+    return list(map(func, chunk))
+
+
+def _imap_chunks(func, iterable, chunk_size, workers=None, parallel_threshold=0):
+    """
+    Applies func to chunk_size-sized lists of iterable items in a process pool.
+    Yields (chunk, result) pairs in the order of chunks. Keeps no more than two chunks per worker in flight,
+    so the source is consumed lazily.
+    If the source has less than parallel_threshold items, func is applied in the current process.
+    """
+    workers = workers or cpu_count() or 1
+    source_chunks = list_chunks(iterable, chunk_size)
+
+    # Chunks are buffered until threshold is reached, a small source isn't worth starting processes
+    buffered, buffered_rows = [], 0
+    for chunk in source_chunks:
+        buffered.append(chunk)
+        buffered_rows += len(chunk)
+        if buffered_rows >= parallel_threshold:
+            break
+    else:
+        for chunk in buffered:
+            yield chunk, func(chunk)
+        return
+
+    # Chunks read ahead by parallel_map are kept by tee until their results are yielded
+    submitted_chunks, yielded_chunks = tee(chain(buffered, source_chunks))
+    results = parallel_map(func, submitted_chunks, workers, mode='process', max_in_flight=workers * 2)
+    yield from zip(yielded_chunks, results)
+
+
+def _split_fields(fields):
+    """
+    Converts comma-separated fields string to list, skipping empty names.
+    Lists and tuples are returned as is.
+    """
+    if isinstance(fields, str):
+        return [field for field in fields.split(',') if field]
+    return fields or []
 
 
 if __name__ == '__main__':
@@ -5,7 +5,7 @@ from json import loads
 import six
 from marshmallow import ValidationError
 
-from .iterators import safe_get, iterate_over_hierarchy
+from .iterators import compile_hierarchy
 from .universal import str_to_list
 
 
@@ -28,7 +28,7 @@ def convert_to_embed(embed_model, many=False, default="%@#not_specified#@%"):
 
 def get_hierarchy(hierarchy, many=False, default="%@#not_specified#@%", convert=None, convert_item=None):
     def _get_single(obj, context, hierarchy, default=None, convert=None):
-        value = safe_get(obj, hierarchy, default)
+        value = hierarchy.get(obj, default)
         if value == default:
             return value
         elif convert:
@@ -36,7 +36,7 @@ def get_hierarchy(hierarchy, many=False, default="%@#not_specified#@%", convert=
         return value
 
     def _get_many(obj, context, hierarchy, default=[], convert=None, convert_item=None):
-        result = list(iterate_over_hierarchy(obj, hierarchy))
+        result = list(hierarchy.iterate(obj))
         if not result:
             return default
         if convert_item:
@@ -47,6 +47,7 @@ def get_hierarchy(hierarchy, many=False, default="%@#not_specified#@%", convert=
 
     # default is different for single and many. If it is specified - pass it, otherwise use functions defaults.
     kwargs = {} if default == "%@#not_specified#@%" else {'default': default}
+    hierarchy = compile_hierarchy(hierarchy)
     if many:
         return partial(_get_many, hierarchy=hierarchy, convert=convert, convert_item=convert_item, **kwargs)
     else:
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+"""
+Columnar (NumPy) representation of a list of dicts for vectorised numeric rollups
+"""
+
+from itertools import compress
+
+import numpy as np
+
+
+class ColumnarListOfDicts(object):
+    """
+    List of dicts stored as one NumPy array per field with a mask of existing keys.
+
+    Fields with values of a single type (int, float, bool) are stored in numeric arrays,
+    other fields (strings, mixed int and float values, ints beyond int64) in object arrays,
+    so to_dicts() returns the same values. Sums of integers are exact: they are computed with Python ints
+    when int64 may overflow.
+    Conversion is explicit: ColumnarListOfDicts.from_dicts(rows) and to_dicts().
+
+    >>> rows = [{'a': 1, 'b': 2.5}, {'a': 2}, {'a': 1, 'b': 1.5, 'c': 'x'}]
+    >>> table = ColumnarListOfDicts.from_dicts(rows)
+    >>> len(table), table.fields
+    (3, ['a', 'b', 'c'])
+    >>> table.column_sum('b')
+    4.0
+    >>> table.to_dicts() == rows
+    True
+    >>> mixed = ColumnarListOfDicts.from_dicts([{'a': 1, 'b': True}, {'a': 2.5, 'b': False}])
+    >>> mixed.to_dicts(), mixed.columns['a'].dtype, mixed.columns['b'].dtype
+    ([{'a': 1, 'b': True}, {'a': 2.5, 'b': False}], dtype('O'), dtype('bool'))
+    """
+
+    def __init__(self, columns, masks, length=0):
+        """
+        :param columns: dict of field -> NumPy array of values (any value where the key is missing)
+        :param masks: dict of field -> boolean NumPy array, True where the key exists
+        :param length: number of rows
+        """
+        self.columns = columns
+        self.masks = masks
+        self.length = length
+
+    @classmethod
+    def from_dicts(cls, rows, fields=None):
+        """
+        Converts list of dicts to columns
+        :param rows: iterable of dicts
+        :param fields: fields to convert, list or comma-separated string. All fields by default.
+        """
+        rows = rows if isinstance(rows, (list, tuple)) else list(rows)
+        fields = _split_fields(fields) if fields else list(dict.fromkeys(key for row in rows for key in row))
+        columns, masks = {}, {}
+        for field in fields:
+            mask = np.fromiter((field in row for row in rows), dtype=bool, count=len(rows))
+            present = [row[field] for row in compress(rows, mask)]
+            # Missing values are filled with a present one to keep column dtype
+            filler = present[0] if present else 0
+            values = [row.get(field, filler) for row in rows]
+            dtype = _column_dtype(present)
+            try:
+                column = np.array(values, dtype=dtype)
+            except OverflowError:
+                column = np.array(values, dtype=object)
+            columns[field], masks[field] = column, mask
+        return cls(columns, masks, len(rows))
+
+    @property
+    def fields(self):
+        return list(self.columns)
+
+    def __len__(self):
+        return self.length
+
+    def to_dicts(self):
+        """Converts columns back to list of dicts. Keys of each dict are ordered as fields."""
+        values = {field: column.tolist() for field, column in self.columns.items()}
+        masks = {field: mask.tolist() for field, mask in self.masks.items()}
+        return [
+            {field: values[field][i] for field in values if masks[field][i]}
+            for i in range(self.length)
+        ]
+
+    def column_sum(self, field):
+        """
+        Sum of the field values, same as list_of_dicts.column_sum
+
+        >>> ColumnarListOfDicts.from_dicts([{'a': 2 ** 62}, {'a': 2 ** 62}]).column_sum('a') == 2 ** 63
+        True
+        """
+        if field not in self.columns:
+            return 0
+        values = self.columns[field][self.masks[field]]
+        if values.dtype == object or _may_exceed(values, len(values), _INT64_MAX):
+            return sum(values.tolist())
+        if values.dtype == bool:
+            values = values.astype(int)
+        return values.sum().item()
+
+    def group(self, by_fields='', sum_fields='', avg_fields='', counter_fields=''):
+        """
+        Vectorised grouping with group_list_of_dicts semantics: groups are in order of the first appearance,
+        missing by fields are equal to None, by fields are taken from the first row of group.
+        Without by_fields all rows make a single group.
+
+        >>> rows = [{'a': 1, 'b': 2}, {'a': 2, 'b': 3}, {'a': 1, 'b': 4, 'c': 'x'}, {'b': 1}]
+        >>> ColumnarListOfDicts.from_dicts(rows).group('a', 'b', avg_fields='b', counter_fields='n')
+        [{'a': 1, 'b': 3.0, 'n': 2}, {'a': 2, 'b': 3.0, 'n': 1}, {'b': 1.0, 'n': 1}]
+        >>> ColumnarListOfDicts.from_dicts(rows).group('a,c', 'b')
+        [{'a': 1, 'b': 2}, {'a': 2, 'b': 3}, {'a': 1, 'c': 'x', 'b': 4}, {'b': 1}]
+        >>> ColumnarListOfDicts.from_dicts([{'a': 1, 'b': 2 ** 62}, {'a': 1, 'b': 2 ** 62}]).group('a', 'b')
+        [{'a': 1, 'b': 9223372036854775808}]
+
+        :param by_fields: fields to group by, list or comma-separated string
+        :param sum_fields: fields to sum
+        :param avg_fields: fields to average (None if there are no values in group)
+        :param counter_fields: fields to write number of rows of group to
+        :return: list of dicts
+        """
+        by_fields = _split_fields(by_fields)
+        group_ids, first_rows = self._factorize_groups(by_fields)
+        groups_count = len(first_rows)
+
+        # By fields of the first row of group
+        grouped = [{} for _ in range(groups_count)]
+        for field in by_fields:
+            if field not in self.columns:
+                continue
+            values = self.columns[field][first_rows].tolist()
+            masks = self.masks[field][first_rows].tolist()
+            for row, value, exists in zip(grouped, values, masks):
+                if exists:
+                    row[field] = value
+
+        order = starts = None
+        if groups_count:
+            order = np.argsort(group_ids, kind='stable')
+            starts = np.flatnonzero(np.r_[True, group_ids[order][1:] != group_ids[order][:-1]])
+        # Accumulated values by fields. If fields lists intersect the last one wins.
+        accumulated = {}
+        for field in _split_fields(sum_fields):
+            accumulated[field] = self._group_sum(field, group_ids, groups_count, order, starts)
+        for field in _split_fields(avg_fields):
+            accumulated[field] = self._group_avg(field, group_ids, groups_count)
+        counts = np.bincount(group_ids, minlength=groups_count).tolist()
+        for field in _split_fields(counter_fields):
+            accumulated[field] = counts
+
+        for field, values in accumulated.items():
+            for row, value in zip(grouped, values):
+                row[field] = value
+        return grouped
+
+    def _factorize(self, field):
+        """Integer codes of field values, missing field is equal to None"""
+        if field not in self.columns:
+            return np.zeros(self.length, dtype=np.int64), 1
+        column, mask = self.columns[field], self.masks[field]
+        if column.dtype != object:
+            uniques, codes = np.unique(column, return_inverse=True)
+            codes = codes.reshape(-1) + 1
+            codes[~mask] = 0
+            return codes, len(uniques) + 1
+        codes_map = {}
+        codes = np.fromiter(
+            (codes_map.setdefault(value if exists else None, len(codes_map))
+             for value, exists in zip(column.tolist(), mask.tolist())),
+            dtype=np.int64, count=self.length
+        )
+        return codes, len(codes_map)
+
+    def _factorize_groups(self, by_fields):
+        """
+        Group ids of rows, numbered in order of the first appearance, and the first row of each group
+        """
+        if not self.length:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        factorized = [self._factorize(field) for field in by_fields]
+        if not factorized:
+            keys = np.zeros(self.length, dtype=np.int64)
+        elif len(factorized) == 1:
+            keys = factorized[0][0]
+        else:
+            codes, dims = zip(*factorized)
+            try:
+                keys = np.ravel_multi_index(codes, dims)
+            except ValueError:
+                keys = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)[1].reshape(-1)
+        uniques, first_rows, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        appearance = np.argsort(first_rows, kind='stable')
+        ranks = np.empty_like(appearance)
+        ranks[appearance] = np.arange(len(appearance))
+        return ranks[inverse.reshape(-1)], first_rows[appearance]
+
+    def _group_sum(self, field, group_ids, groups_count, order, starts):
+        if not groups_count:
+            return []
+        if field not in self.columns:
+            return [0] * groups_count
+        column, mask = self.columns[field], self.masks[field]
+        largest_group = np.diff(np.r_[starts, len(order)]).max()
+        if column.dtype == object or _may_exceed(column[mask], largest_group, _INT64_MAX):
+            return _python_group_sums(column, mask, group_ids, groups_count)
+        if column.dtype == bool:
+            column = column.astype(int)
+        values = np.where(mask, column, 0)
+        return np.add.reduceat(values[order], starts).tolist()
+
+    def _group_avg(self, field, group_ids, groups_count):
+        if field not in self.columns:
+            return [None] * groups_count
+        column, mask = self.columns[field], self.masks[field]
+        counts = np.bincount(group_ids, weights=mask.astype(float), minlength=groups_count)
+        # Float sums of integers are exact up to 2 ** 53
+        if column.dtype == object or _may_exceed(column[mask], self.length, _FLOAT_EXACT_MAX):
+            sums = _python_group_sums(column, mask, group_ids, groups_count)
+        else:
+            sums = np.bincount(group_ids, weights=np.where(mask, column, 0), minlength=groups_count).tolist()
+        return [total / count if count else None for total, count in zip(sums, counts.tolist())]
+
+
+_INT64_MAX = np.iinfo(np.int64).max
+_FLOAT_EXACT_MAX = 2 ** 53
+
+
+def _column_dtype(values):
+    """
+    Numeric dtype of values of a single type (int, float, bool or NumPy scalar type), object dtype otherwise.
+    Mixed types are not coerced, so values are converted back unchanged.
+    """
+    types = set(map(type, values))
+    if not types:
+        return np.dtype(int)
+    if len(types) > 1:
+        return np.dtype(object)
+    value_type = types.pop()
+    if value_type in (int, float, bool) or issubclass(value_type, (np.integer, np.floating, np.bool_)):
+        return np.dtype(value_type)
+    return np.dtype(object)
+
+
+def _may_exceed(values, count, limit):
+    """Checks if a sum of count integer values of the array may exceed limit by absolute value"""
+    if values.dtype.kind not in 'iu' or not values.size:
+        return False
+    return max(int(values.max()), -int(values.min())) * int(count) > limit
+
+
+def _python_group_sums(column, mask, group_ids, groups_count):
+    """Exact sums of existing values by groups, with Python numbers"""
+    sums = [0] * groups_count
+    for group_id, value in compress(zip(group_ids.tolist(), column.tolist()), mask.tolist()):
+        sums[group_id] += value
+    return sums
+
+
+def _split_fields(fields):
+    """Converts comma-separated fields string to list, skipping empty names. Lists and tuples are returned as is."""
+    if isinstance(fields, str):
+        return [field for field in fields.split(',') if field]
+    return fields or []
+
+
+if __name__ == '__main__':
+
+    def _test_module():
+        import doctest
+        result = doctest.testmod()
+        if not result.failed:
+            print(f"{result.attempted} passed and {result.failed} failed.\nTest passed.")
+
+    _test_module()
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 # coding=utf-8
 
-from snuff_utils.iterators import safe_get
+from bisect import bisect_left, bisect_right
+from itertools import chain, islice
+
+from snuff_utils.iterators import compile_hierarchy
+from snuff_utils.list_of_dicts import compile_sort_key, structural_key
 
 
 def default_cmp(one, other):
@@ -29,30 +33,15 @@ def compare_by_weight(*weight_sequence, partial=False):
     if isinstance(weight_sequence, str):
         weight_sequence = weight_sequence.split(',')
 
-    def wrapped(one, other):
-        cmp_map = {'one': False, 'other': False}
-        weight_index_map = {'one': 0, 'other': 0}
-        for variable, match_key in [(one, 'one'), (other, 'other')]:
-            if not partial or not isinstance(variable, dict):
-                cmp_map[match_key] = variable in weight_sequence
-                if cmp_map[match_key]:
-                    weight_index_map[match_key] = weight_sequence.index(variable)
-                continue
+    weigher = _Weigher(weight_sequence, partial)
 
-            for cmp_dict in weight_sequence:
-                if not isinstance(cmp_dict, dict):
-                    continue
-                if all([safe_get(variable, key) == value for key, value in cmp_dict.items()]):
-                    cmp_map[match_key] = True
-                    weight_index_map[match_key] = weight_sequence.index(cmp_dict)
-                    break
-            else:
-                cmp_map[match_key] = False
-        if all(cmp_map.values()):
-            return weight_index_map['one'] - weight_index_map['other']
-        elif cmp_map['one']:
+    def wrapped(one, other):
+        weight_one, weight_other = weigher(one), weigher(other)
+        if weight_one is not None and weight_other is not None:
+            return weight_one - weight_other
+        elif weight_one is not None:
             return -1
-        elif cmp_map['other']:
+        elif weight_other is not None:
             return 1
         return default_cmp(one, other)
 
@@ -113,6 +102,362 @@ def cmp_by_weight(*weight_sequence, partial=False):
     return cmp_for_sorted(compare_by_weight(weight_sequence, partial=partial))
 
 
+def key_by_weight(*weight_sequence, partial=False):
+    """
+    Returns 'key' function for 'sorted' that orders values by index in weight sequence, as cmp_by_weight does.
+    Weights are precomputed: every value is weighed once with a dict lookup, keys are tuples.
+    Values absent in the sequence follow in natural order, unweighted dicts go last
+    (cmp_by_weight treats them as equal to any value).
+
+    :param weight_sequence: weight sequence, list of values, allow comma-separated string
+    :param partial: dicts match weight sequence dicts by their keys only (keys may be hierarchies: 'a.b')
+
+    >>> sorted('a,r,b,c,d,e'.split(','), key=key_by_weight('c,a,d,b'))
+    ['c', 'a', 'd', 'b', 'e', 'r']
+    >>> sorted([1, 2, 3, 4, 5, 6, 7], key=key_by_weight(1, 5, 7))
+    [1, 5, 7, 2, 3, 4, 6]
+    >>> sorted([{'a': 1}, {'b': 2}, {'c': 5, 'a': 2}], key=key_by_weight({'c': 5}, {'b': 2}))
+    [{'b': 2}, {'a': 1}, {'c': 5, 'a': 2}]
+    >>> sorted([{'a': 1}, {'b': 2}, {'c': 5, 'a': 2}], key=key_by_weight({'c': 5}, {'b': 2}, partial=True))
+    [{'c': 5, 'a': 2}, {'b': 2}, {'a': 1}]
+    >>> key_by_weight('c,a')('a'), key_by_weight('c,a')('x')
+    ((0, 1), (1, 'x'))
+    """
+    if len(weight_sequence) == 1:
+        weight_sequence = weight_sequence[0]
+    if isinstance(weight_sequence, str):
+        weight_sequence = weight_sequence.split(',')
+    weigher = _Weigher(weight_sequence, partial)
+
+    def key(value):
+        weight = weigher(value)
+        if weight is not None:
+            return 0, weight
+        if isinstance(value, dict):
+            return 2,
+        return 1, value
+
+    return key
+
+
+class _Weigher(object):
+    """
+    Index of a value in weight sequence (the first equal one), None if it's absent.
+    Values are looked up by structural keys. In partial mode dicts are matched by values of weight dicts keys:
+    weight dicts with the same keys make one lookup dict of values tuples.
+    """
+
+    def __init__(self, weight_sequence, partial=False):
+        self.partial = partial
+        self.weights = {}
+        for index, value in enumerate(weight_sequence):
+            self.weights.setdefault(structural_key(value), index)
+
+        # Matchers of partial mode: (compiled hierarchies, {values: index}, [(unhashable values, index)])
+        matchers = {}
+        for index, value in enumerate(weight_sequence if partial else ()):
+            if not isinstance(value, dict):
+                continue
+            fields = tuple(sorted(value, key=str))
+            if fields not in matchers:
+                matchers[fields] = (tuple(compile_hierarchy(field) for field in fields), {}, [])
+            values = tuple(value[field] for field in fields)
+            _, indexes, unhashable = matchers[fields]
+            try:
+                indexes.setdefault(values, index)
+            except TypeError:
+                unhashable.append((values, index))
+        self.matchers = list(matchers.values())
+
+    def __call__(self, value):
+        if not self.partial or not isinstance(value, dict):
+            return self.weights.get(structural_key(value))
+        weight = None
+        for paths, indexes, unhashable in self.matchers:
+            values = tuple(path.get(value) for path in paths)
+            try:
+                index = indexes.get(values)
+            except TypeError:
+                index = next((index for weight_values, index in unhashable if weight_values == values), None)
+            if index is not None and (weight is None or index < weight):
+                weight = index
+        return weight
+
+
+class SortedCollection(object):
+    """
+    Collection kept in order under inserts and removals.
+    Order is set by sort_list_of_dicts keys spec, weight sequence of key_by_weight (weights go first) or both.
+    Items with equal keys keep insertion order.
+
+    Items are stored in sublists of about _load items with their keys, sublists are found by bisect
+    over their maximal keys and positions are counted with a binary indexed tree of sublists lengths,
+    so insert, remove, rank and access by position take O(log n) (plus a short list insert or delete).
+
+    >>> tasks = SortedCollection(keys='-priority,created', weights=[{'status': 'urgent'}], partial=True)
+    >>> tasks.update([{'id': 1, 'priority': 1, 'created': 1}, {'id': 2, 'priority': 2, 'created': 2}])
+    >>> tasks.add({'id': 3, 'priority': 1, 'created': 0, 'status': 'urgent'})
+    >>> tasks.add({'id': 4, 'priority': 1, 'created': 3})
+    >>> [task['id'] for task in tasks]
+    [3, 2, 1, 4]
+    >>> tasks.rank({'priority': 1, 'created': 2}), tasks[-1]['id'], [task['id'] for task in tasks[1:3]]
+    (3, 4, [2, 1])
+    >>> tasks.remove({'id': 2, 'priority': 2, 'created': 2})
+    >>> [task['id'] for task in tasks.irange({'priority': 1, 'created': 1}, {'priority': 1, 'created': 3})]
+    [1, 4]
+    >>> numbers = SortedCollection([5, 1, 3])
+    >>> numbers.add(2), list(numbers), numbers.index(3), 4 in numbers
+    (None, [1, 2, 3, 5], 2, False)
+    """
+
+    _load = 1000
+
+    def __init__(self, items=(), keys=None, weights=None, partial=False, default=None, **convert):
+        """
+        :param items: initial items
+        :param keys: sort_list_of_dicts keys spec ('-priority,created'), or key function
+        :param weights: weight sequence of key_by_weight, list or comma-separated string
+        :param partial: partial matching of weight dicts, see key_by_weight
+        :param default: default value of missing keys fields, or dict of defaults by fields
+        :param convert: conversion functions of keys fields values
+        """
+        self.key = _collection_key(keys, weights, partial, default, convert)
+        self._lists = []
+        self._keys = []
+        self._maxes = []
+        self._len = 0
+        # Binary indexed tree of sublists lengths, None if it is to be rebuilt
+        self._tree = None
+        self.update(items)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return chain.from_iterable(self._lists)
+
+    def __reversed__(self):
+        return chain.from_iterable(map(reversed, reversed(self._lists)))
+
+    def __contains__(self, item):
+        return self._find(item) is not None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({list(self)!r})'
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step == 1:
+                return list(islice(self._iterate_from(start), max(stop - start, 0)))
+            return [self[i] for i in range(start, stop, step)]
+        pos, i = self._locate(index)
+        return self._lists[pos][i]
+
+    def add(self, item):
+        """Inserts item after items with equal key"""
+        key = self.key(item)
+        if not self._maxes:
+            self._lists.append([item])
+            self._keys.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            self._tree = None
+            return
+        pos = bisect_right(self._maxes, key)
+        if pos == len(self._maxes):
+            pos -= 1
+            self._maxes[pos] = key
+        keys = self._keys[pos]
+        i = bisect_right(keys, key)
+        keys.insert(i, key)
+        self._lists[pos].insert(i, item)
+        self._len += 1
+        if len(keys) > self._load * 2:
+            self._split(pos)
+        else:
+            self._update_tree(pos, 1)
+
+    def update(self, items):
+        """Adds items. Many items are added by one sort of the whole collection."""
+        items = list(items)
+        if len(items) * 4 < self._len:
+            for item in items:
+                self.add(item)
+            return
+        items = list(self) + items
+        keys = list(map(self.key, items))
+        order = sorted(range(len(items)), key=keys.__getitem__)
+        self._lists = [[items[i] for i in order[start:start + self._load]]
+                       for start in range(0, len(order), self._load)]
+        self._keys = [[keys[i] for i in order[start:start + self._load]]
+                      for start in range(0, len(order), self._load)]
+        self._maxes = [keys[-1] for keys in self._keys]
+        self._len = len(items)
+        self._tree = None
+
+    def remove(self, item):
+        """Removes the first item equal to item. Raises ValueError if there is none."""
+        location = self._find(item)
+        if location is None:
+            raise ValueError(f'{item!r} is not in {self.__class__.__name__}')
+        self._delete(*location)
+
+    def discard(self, item):
+        """Removes the first item equal to item if there is one"""
+        location = self._find(item)
+        if location is not None:
+            self._delete(*location)
+
+    def pop(self, index=-1):
+        """Removes and returns item at position"""
+        pos, i = self._locate(index)
+        item = self._lists[pos][i]
+        self._delete(pos, i)
+        return item
+
+    def index(self, item):
+        """Position of the first item equal to item. Raises ValueError if there is none."""
+        location = self._find(item)
+        if location is None:
+            raise ValueError(f'{item!r} is not in {self.__class__.__name__}')
+        return self._position(*location)
+
+    def rank(self, item):
+        """Number of items ordered before item (items with equal key are not counted)"""
+        return self.bisect_left(item)
+
+    def bisect_left(self, item):
+        """Position to insert item before items with equal key"""
+        key = self.key(item)
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            return self._len
+        return self._position(pos, bisect_left(self._keys[pos], key))
+
+    def bisect_right(self, item):
+        """Position to insert item after items with equal key"""
+        key = self.key(item)
+        pos = bisect_right(self._maxes, key)
+        if pos == len(self._maxes):
+            return self._len
+        return self._position(pos, bisect_right(self._keys[pos], key))
+
+    def irange(self, minimum=None, maximum=None, inclusive=(True, True)):
+        """
+        Iterates over items with keys between keys of minimum and maximum items.
+        None means no bound.
+        """
+        start = 0
+        if minimum is not None:
+            start = self.bisect_left(minimum) if inclusive[0] else self.bisect_right(minimum)
+        stop = self._len
+        if maximum is not None:
+            stop = self.bisect_right(maximum) if inclusive[1] else self.bisect_left(maximum)
+        return islice(self._iterate_from(start), max(stop - start, 0))
+
+    def _iterate_from(self, start):
+        if start >= self._len:
+            return iter(())
+        pos, i = self._locate(start)
+        return chain(islice(self._lists[pos], i, None), chain.from_iterable(self._lists[pos + 1:]))
+
+    def _find(self, item):
+        """(sublist, position) of the first item equal to item, None if there is none"""
+        key = self.key(item)
+        pos = bisect_left(self._maxes, key)
+        while pos < len(self._maxes):
+            keys, items = self._keys[pos], self._lists[pos]
+            i = bisect_left(keys, key)
+            while i < len(keys) and not key < keys[i]:
+                if items[i] is item or items[i] == item:
+                    return pos, i
+                i += 1
+            if i < len(keys):
+                return None
+            pos += 1
+        return None
+
+    def _delete(self, pos, i):
+        del self._lists[pos][i]
+        del self._keys[pos][i]
+        self._len -= 1
+        if not self._keys[pos]:
+            del self._lists[pos], self._keys[pos], self._maxes[pos]
+            self._tree = None
+            return
+        self._maxes[pos] = self._keys[pos][-1]
+        self._update_tree(pos, -1)
+
+    def _split(self, pos):
+        items, keys = self._lists[pos], self._keys[pos]
+        self._lists[pos:pos + 1] = [items[:self._load], items[self._load:]]
+        self._keys[pos:pos + 1] = [keys[:self._load], keys[self._load:]]
+        self._maxes[pos:pos + 1] = [keys[self._load - 1], keys[-1]]
+        self._tree = None
+
+    def _build_tree(self):
+        tree = [0] * (len(self._lists) + 1)
+        for j, items in enumerate(self._lists, 1):
+            tree[j] += len(items)
+            parent = j + (j & -j)
+            if parent < len(tree):
+                tree[parent] += tree[j]
+        self._tree = tree
+
+    def _update_tree(self, pos, delta):
+        if self._tree is None:
+            return
+        tree, j = self._tree, pos + 1
+        while j < len(tree):
+            tree[j] += delta
+            j += j & -j
+
+    def _position(self, pos, i):
+        """Position of i-th item of pos-th sublist"""
+        if self._tree is None:
+            self._build_tree()
+        tree, j = self._tree, pos
+        while j:
+            i += tree[j]
+            j -= j & -j
+        return i
+
+    def _locate(self, index):
+        """(sublist, position) of item at index"""
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError(f'{self.__class__.__name__} index out of range')
+        if self._tree is None:
+            self._build_tree()
+        tree, pos = self._tree, 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            if pos + step < len(tree) and tree[pos + step] <= index:
+                pos += step
+                index -= tree[pos]
+            step >>= 1
+        return pos, index
+
+
+def _collection_key(keys=None, weights=None, partial=False, default=None, convert=None):
+    """Key function of SortedCollection: weights key, then keys spec key"""
+    key_functions = []
+    if weights is not None:
+        key_functions.append(key_by_weight(weights, partial=partial))
+    if callable(keys):
+        key_functions.append(keys)
+    elif keys:
+        key_functions.append(compile_sort_key(keys, default=default, convert=convert))
+
+    if not key_functions:
+        return lambda item: item
+    if len(key_functions) == 1:
+        return key_functions[0]
+    return lambda item: tuple([key_function(item) for key_function in key_functions])
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()